@@ -1,16 +1,24 @@
 import os
-from typing import Optional
+from typing import Literal, Optional
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite:///./quanta_copilot.db"
+    tasks_database_url: Optional[str] = "sqlite:///./quanta_copilot_tasks.db"  # None = main DB
+    db_pool_size: int = 10
+    db_max_overflow: int = 5
+    db_pool_timeout: int = 30
+    db_pool_recycle: int = 3600  # Seconds
     
     # Optional external services (with fallbacks)
     redis_url: Optional[str] = None  # None = use in-process tasks
     qdrant_url: Optional[str] = None  # None = use FAISS
     qdrant_api_key: Optional[str] = None
+    qdrant_prefer_grpc: bool = True  # Vectors sent as protobuf, not JSON floats
+    qdrant_grpc_port: int = 6334
+    qdrant_upload_batch_size: int = 1024
     
     # Ollama
     ollama_url: str = "http://localhost:11434"
@@ -24,22 +32,52 @@ class Settings(BaseSettings):
     
     # Embeddings (M1-optimized)
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_backend: Literal["torch", "onnx"] = "torch"  # onnx needs the onnx extra
+    # ONNX weights within the model repo, e.g. "onnx/model_qint8_arm64.onnx" (int8)
+    # or "onnx/model_O4.onnx" (fp16); None exports/loads the default fp32 model
+    embedding_onnx_file: Optional[str] = None
     chunk_size: int = 800  # Smaller chunks for memory efficiency
     chunk_overlap: int = 150
+    embedding_storage: Literal["f32", "f16", "int8"] = "int8"  # Vector storage precision
+    embedding_batch_size: int = 64
+    embedding_concurrency: int = 2  # Batches a Celery worker embeds at once
+    check_embedding_norms: bool = False  # Debug: reject vectors that aren't unit length
+    faiss_index: Literal["flat", "hnsw"] = "hnsw"  # Exhaustive vs graph search
+    faiss_hnsw_m: int = 32  # Graph neighbors per vector
+    faiss_hnsw_ef_construction: int = 200
+    faiss_hnsw_ef_search: int = 64  # Recall/latency knob
+    faiss_flush_interval: int = 30  # Seconds between writes of changed indexes
+    enable_chunk_cache: bool = True  # Reuse chunks/embeddings for re-uploaded content
+    chunk_cache_dir: str = "./cache/chunks"
     
     # RAG (M1-optimized)
     top_k: int = 8
     similarity_threshold: float = 0.7
-    max_concurrent_tasks: int = 2  # Limit concurrent processing
+    max_concurrent_tasks: int = max((os.cpu_count() or 2) - 1, 1)  # Documents processed at once
+    chat_history_limit: int = 20  # Messages loaded for prompt history
+    query_embedding_cache_size: int = 512  # Cached chat query embeddings
+    chunk_embedding_cache_size: int = 10000  # Chunk vectors a Celery worker reuses for repeated text
+    prompt_context_cache_size: int = 128  # Cached prompt prefixes (system prompt + context)
+    enable_retrieval_gating: bool = True  # Skip vector search for small talk
+    status_cache_ttl: int = 3  # Seconds status polls are served from cache
     
     # Web crawling (lightweight)
     max_crawl_depth: int = 1  # Default depth 1
     max_urls_per_crawl: int = 20  # Reduced for memory
     crawl_timeout: int = 30  # Timeout in seconds
+    crawl_concurrency: int = 10  # Pages fetched in parallel
+    crawl_max_page_bytes: int = 2 * 1024 * 1024  # 2MB, larger pages are truncated
+    enable_crawl_cache: bool = True
+    crawl_cache_dir: str = "./cache/http"
+    crawl_cache_ttl: int = 86400  # Seconds a page is served without revalidating
+    crawl_cache_size_limit: int = 512 * 1024 * 1024  # 512MB, least recently used evicted
     
     # OCR (optional)
     enable_ocr: bool = False  # Disabled by default for M1
     ocr_language: str = "eng"
+    ocr_dpi: int = 300  # Render resolution for OCR (PDF default is 72)
+    enable_ocr_cache: bool = True
+    ocr_cache_dir: str = "./cache/ocr"
     
     # Playwright (optional)
     enable_playwright: bool = False  # Disabled by default
@@ -1,22 +1,133 @@
-from sqlmodel import Session, create_engine, SQLModel
+from fastapi import HTTPException
+from sqlmodel import Session, create_engine, SQLModel, select
+from sqlalchemy import bindparam, event, lambda_stmt
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool
+from sqlmodel.ext.asyncio.session import AsyncSession
 from .config import settings
+from .models import Bot, Task
 import os
 
 # Create upload directory if it doesn't exist
 os.makedirs(settings.upload_dir, exist_ok=True)
 
+# SQLite pragmas applied to every new connection (WAL lets chat reads
+# proceed while ingest tasks are writing)
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-64000",  # 64MB page cache
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=2147483648",  # 2GB
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",
+]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply performance pragmas to each new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def _create_engine(database_url: str):
+    """Create a pooled engine (connections and their page cache are reused
+    across requests instead of reopened per session)"""
+    is_sqlite = "sqlite" in database_url
+    db_engine = create_engine(
+        database_url,
+        echo=False,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        poolclass=QueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        # A local SQLite file can't drop a connection, so skip the SELECT 1
+        # liveness round trip on every checkout there
+        pool_pre_ping=not is_sqlite,
+        pool_recycle=settings.db_pool_recycle,
+    )
+
+    if is_sqlite:
+        event.listen(db_engine, "connect", _set_sqlite_pragmas)
+
+    return db_engine
+
+
+def _async_database_url(database_url: str) -> str:
+    """Map a sync database URL onto its asyncio driver"""
+    for sync_prefix, async_prefix in (
+        ("sqlite://", "sqlite+aiosqlite://"),
+        ("postgresql://", "postgresql+asyncpg://"),
+    ):
+        if database_url.startswith(sync_prefix):
+            return async_prefix + database_url[len(sync_prefix):]
+    return database_url
+
+
+def _create_async_engine(database_url: str):
+    """Create a pooled asyncio engine for the read-heavy polling endpoints"""
+    is_sqlite = "sqlite" in database_url
+    db_engine = create_async_engine(
+        _async_database_url(database_url),
+        echo=False,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_pre_ping=not is_sqlite,
+        pool_recycle=settings.db_pool_recycle,
+    )
+
+    if is_sqlite:
+        event.listen(db_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+    return db_engine
+
+
 # Database engine
-engine = create_engine(
-    settings.database_url,
-    echo=False,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.database_url else {}
-)
+engine = _create_engine(settings.database_url)
+async_engine = _create_async_engine(settings.database_url)
+
+# Task bookkeeping lives in its own database file when configured, so its
+# frequent writes don't contend for the main database's write lock
+if settings.tasks_database_url and settings.tasks_database_url != settings.database_url:
+    tasks_engine = _create_engine(settings.tasks_database_url)
+else:
+    tasks_engine = engine
+
+SESSION_BINDS = {Task: tasks_engine}
 
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    main_tables = [
+        table for table in SQLModel.metadata.sorted_tables
+        if table is not Task.__table__
+    ]
+    SQLModel.metadata.create_all(engine, tables=main_tables)
+    SQLModel.metadata.create_all(tasks_engine, tables=[Task.__table__])
 
 
 def get_session():
-    with Session(engine) as session:
+    with Session(engine, binds=SESSION_BINDS) as session:
         yield session
+
+
+async def get_async_session():
+    async with AsyncSession(async_engine) as session:
+        yield session
+
+
+# Cached slug lookup shared by the routes that address bots by slug
+_BOT_BY_SLUG = lambda_stmt(lambda: select(Bot).where(Bot.slug == bindparam("slug")))
+
+
+def resolve_bot_or_404(session: Session, slug: str) -> Bot:
+    """Get a bot by slug or raise a 404"""
+    bot = session.execute(_BOT_BY_SLUG, {"slug": slug}).scalars().first()
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    return bot
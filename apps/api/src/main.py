@@ -1,14 +1,21 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from .deps import create_db_and_tables
 from .routes import bots, uploads, chat, ingest, status
 from .config import settings
+from .services.crawl import WebCrawler
+from .services.embed import EmbeddingService
+from .services.index import VectorIndex
+from .services.index_faiss import vector_index_manager
+from .services.rag import RAGService
 
 # Create FastAPI app
 app = FastAPI(
     title="Source-Grounded Research Copilot API",
     description="A RAG-powered research assistant with source citations",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -31,6 +38,21 @@ app.include_router(status.router)
 @app.on_event("startup")
 async def startup_event():
     create_db_and_tables()
+    
+    # Shared services (loading the embedding model once per process)
+    app.state.embedder = EmbeddingService()
+    app.state.vector_index = VectorIndex()
+    app.state.rag = RAGService()
+    app.state.crawler = WebCrawler()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Write FAISS indexes changed since the last periodic flush
+    vector_index_manager.flush_all()
+    
+    # Release the crawler's pooled connections and browser
+    await app.state.crawler.close()
+    await app.state.rag.close()
 
 @app.get("/")
 async def root():
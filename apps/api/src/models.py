@@ -1,9 +1,22 @@
 from datetime import datetime
 from typing import Optional, Dict, Any, List
-from sqlmodel import SQLModel, Field
-from sqlalchemy import Column, String, Text
+from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, Index, String, Text, func
 import json
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
+
+
+def created_timestamp_field():
+    """Insert timestamp, filled in by SQLAlchemy on insert (ORM and bulk inserts alike).
+
+    The server default only exists on tables created since it was added;
+    create_all doesn't alter existing ones, so the value is still sent.
+    """
+    return Field(
+        default=None,
+        nullable=False,
+        sa_column_kwargs={"default": datetime.utcnow, "server_default": func.now()}
+    )
 
 
 class BotBase(SQLModel):
@@ -15,7 +28,7 @@ class BotBase(SQLModel):
 class Bot(BotBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     slug: str = Field(unique=True, index=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = created_timestamp_field()
 
 
 class BotCreate(BotBase):
@@ -37,11 +50,25 @@ class DocumentBase(SQLModel):
 
 
 class Document(DocumentBase, table=True):
+    __table_args__ = (Index("ix_document_bot_status", "bot_id", "status"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    bot_id: int = Field(foreign_key="bot.id")
+    bot_id: int = Field(foreign_key="bot.id")  # Leading column of the bot/status index
     path_original: str
     path_parsed: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = created_timestamp_field()
+
+    def merge_metadata(self, extra: Dict[str, Any]):
+        """Merge extra keys into doc_metadata with one assignment (one column write).
+
+        Nothing is written when there is nothing to add, and the default empty
+        object is not decoded just to be merged into.
+        """
+        if not extra:
+            return
+        stored = self.doc_metadata
+        merged = {**json.loads(stored), **extra} if stored and stored != "{}" else extra
+        self.doc_metadata = json.dumps(merged, separators=(',', ':'), default=str)
 
 
 class DocumentCreate(DocumentBase):
@@ -65,9 +92,9 @@ class ChunkBase(SQLModel):
 
 class Chunk(ChunkBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    bot_id: int = Field(foreign_key="bot.id")
-    document_id: int = Field(foreign_key="document.id")
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    bot_id: int = Field(foreign_key="bot.id", index=True)
+    document_id: int = Field(foreign_key="document.id", index=True)
+    created_at: Optional[datetime] = created_timestamp_field()
 
 
 class ChunkCreate(ChunkBase):
@@ -88,8 +115,12 @@ class ChatBase(SQLModel):
 
 class Chat(ChatBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    bot_id: int = Field(foreign_key="bot.id")
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    bot_id: int = Field(foreign_key="bot.id", index=True)
+    created_at: Optional[datetime] = created_timestamp_field()
+    messages: List["Message"] = Relationship(
+        back_populates="chat",
+        sa_relationship_kwargs={"order_by": "Message.created_at"}
+    )
 
 
 class ChatCreate(ChatBase):
@@ -109,9 +140,14 @@ class MessageBase(SQLModel):
 
 
 class Message(MessageBase, table=True):
+    __table_args__ = (Index("ix_msg_chat_created", "chat_id", "created_at"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     chat_id: int = Field(foreign_key="chat.id")
+    # Set in Python: CURRENT_TIMESTAMP has one-second resolution, which would
+    # tie a user message and its reply inserted together
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    chat: Optional[Chat] = Relationship(back_populates="messages")
 
 
 class MessageCreate(MessageBase):
@@ -131,10 +167,12 @@ class UrlSourceBase(SQLModel):
 
 
 class UrlSource(UrlSourceBase, table=True):
+    __table_args__ = (Index("ix_urlsource_bot_status", "bot_id", "status"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
-    bot_id: int = Field(foreign_key="bot.id")
+    bot_id: int = Field(foreign_key="bot.id")  # Leading column of the bot/status index
     fetched_urls: str = Field(default="[]", sa_column=Column(Text, nullable=True))
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: Optional[datetime] = created_timestamp_field()
 
 
 class UrlSourceCreate(UrlSourceBase):
@@ -147,6 +185,14 @@ class UrlSourceRead(UrlSourceBase):
     fetched_urls: List[str]
     created_at: datetime
 
+    @field_validator("fetched_urls", mode="before")
+    @classmethod
+    def parse_fetched_urls(cls, value):
+        """fetched_urls is stored as a JSON string"""
+        if isinstance(value, str):
+            return json.loads(value or "[]")
+        return value
+
 
 # Pydantic models for API requests/responses
 class ChatRequest(BaseModel):
@@ -175,7 +221,8 @@ class TaskBase(SQLModel):
 
 class Task(TaskBase, table=True):
     id: str = Field(primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    parent_id: Optional[str] = Field(default=None, foreign_key="task.id", index=True)  # Upload batch
+    created_at: Optional[datetime] = created_timestamp_field()
     started_at: Optional[datetime] = None
     completed_at: Optional[datetime] = None
 
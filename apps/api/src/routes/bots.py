@@ -1,35 +1,43 @@
+import os
 import uuid
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from ..deps import get_session
-from ..models import Bot, BotCreate, BotRead
+from ..deps import get_session, resolve_bot_or_404
+from ..models import Bot, BotCreate, BotRead, Chat, Chunk, Document, Message, UrlSource
+from ..utils.status_cache import status_cache
 
 router = APIRouter(prefix="/bots", tags=["bots"])
 
+SLUG_RETRIES = 3
+
 
 @router.post("/", response_model=BotRead)
 def create_bot(bot_data: BotCreate, session: Session = Depends(get_session)):
     """Create a new bot"""
     try:
-        # Generate a unique slug
-        slug = f"{bot_data.name.lower().replace(' ', '-')}-{str(uuid.uuid4())[:8]}"
-        
-        # Check if slug already exists
-        existing_bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if existing_bot:
-            # Generate a different slug
-            slug = f"{bot_data.name.lower().replace(' ', '-')}-{str(uuid.uuid4())[:8]}"
+        base_slug = bot_data.name.lower().replace(' ', '-')
         
-        bot = Bot(
-            name=bot_data.name,
-            description=bot_data.description,
-            owner=bot_data.owner,
-            slug=slug
-        )
+        # Rely on the UNIQUE constraint on slug and retry with a new suffix on collision
+        for attempt in range(SLUG_RETRIES):
+            bot = Bot(
+                name=bot_data.name,
+                description=bot_data.description,
+                owner=bot_data.owner,
+                slug=f"{base_slug}-{uuid.uuid4().hex[:8]}"
+            )
+            
+            session.add(bot)
+            try:
+                session.commit()
+                break
+            except IntegrityError:
+                session.rollback()
+                if attempt == SLUG_RETRIES - 1:
+                    raise
         
-        session.add(bot)
-        session.commit()
         session.refresh(bot)
         
         return bot
@@ -67,9 +75,7 @@ def get_bot(bot_id: int, session: Session = Depends(get_session)):
 def get_bot_by_slug(slug: str, session: Session = Depends(get_session)):
     """Get a bot by its slug"""
     try:
-        bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
+        bot = resolve_bot_or_404(session, slug)
         return bot
     except HTTPException:
         raise
@@ -85,34 +91,30 @@ def delete_bot(bot_id: int, session: Session = Depends(get_session)):
         if not bot:
             raise HTTPException(status_code=404, detail="Bot not found")
         
-        # Delete associated documents, chunks, chats, etc.
-        from ..models import Document, Chunk, Chat, UrlSource
+        # Collect file paths without hydrating Document objects
+        file_paths = session.exec(
+            select(Document.path_original, Document.path_parsed).where(Document.bot_id == bot_id)
+        ).all()
         
-        # Delete chunks
-        session.exec(select(Chunk).where(Chunk.bot_id == bot_id)).all()
-        
-        # Delete documents
-        documents = session.exec(select(Document).where(Document.bot_id == bot_id)).all()
-        for doc in documents:
-            # Delete files
-            import os
-            if doc.path_original and os.path.exists(doc.path_original):
-                os.remove(doc.path_original)
-            if doc.path_parsed and os.path.exists(doc.path_parsed):
-                os.remove(doc.path_parsed)
-        
-        # Delete URL sources
-        session.exec(select(UrlSource).where(UrlSource.bot_id == bot_id)).all()
-        
-        # Delete chats and messages
-        chats = session.exec(select(Chat).where(Chat.bot_id == bot_id)).all()
-        for chat in chats:
-            from ..models import Message
-            session.exec(select(Message).where(Message.chat_id == chat.id)).all()
+        # Bulk delete associated rows in foreign-key order
+        chat_ids = select(Chat.id).where(Chat.bot_id == bot_id)
+        session.exec(delete(Message).where(Message.chat_id.in_(chat_ids)))
+        session.exec(delete(Chunk).where(Chunk.bot_id == bot_id))
+        session.exec(delete(Document).where(Document.bot_id == bot_id))
+        session.exec(delete(UrlSource).where(UrlSource.bot_id == bot_id))
+        session.exec(delete(Chat).where(Chat.bot_id == bot_id))
         
         # Delete the bot
         session.delete(bot)
         session.commit()
+        status_cache.invalidate(bot_id)
+        
+        # Delete files once the rows are gone
+        for path_original, path_parsed in file_paths:
+            if path_original and os.path.exists(path_original):
+                os.remove(path_original)
+            if path_parsed and os.path.exists(path_parsed):
+                os.remove(path_parsed)
         
         return {"message": "Bot deleted successfully"}
         
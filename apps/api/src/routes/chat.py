@@ -1,16 +1,25 @@
+import hashlib
 import json
+import threading
+import numpy as np
+import orjson
 from typing import List, Dict, Any
+from cachetools import LRUCache
 from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import selectinload
 from sqlmodel import Session, select
-from ..deps import get_session
-from ..models import Bot, Chat, Message, ChatRequest, ChatResponse
-from ..services.embed import EmbeddingService
-from ..services.index import VectorIndex
-from ..services.rag import RAGService
+from ..config import settings
+from ..deps import SESSION_BINDS, engine, get_session, resolve_bot_or_404
+from ..models import Chat, Message, ChatRequest, ChatResponse
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Query embeddings keyed by a hash of the normalized message
+_embed_cache = LRUCache(maxsize=settings.query_embedding_cache_size)
+_embed_cache_lock = threading.Lock()
+
 
 @router.post("/{slug}")
 async def chat_with_bot(
@@ -21,58 +30,37 @@ async def chat_with_bot(
 ):
     """Chat with a bot using RAG"""
     try:
-        # Get bot by slug
-        bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
-        
-        # Get or create chat
-        chat_id = chat_request.chat_id
-        if not chat_id:
-            chat = Chat(bot_id=bot.id)
-            session.add(chat)
-            session.commit()
-            session.refresh(chat)
-            chat_id = chat.id
-        else:
-            chat = session.get(Chat, chat_id)
-            if not chat or chat.bot_id != bot.id:
-                raise HTTPException(status_code=404, detail="Chat not found")
+        # Blocking SQLite work runs in the threadpool to keep the event loop free
+        bot_id, chat_id, history = await run_in_threadpool(
+            _prepare_chat, session, slug, chat_request
+        )
         
-        # Save user message
+        # The user message is persisted together with the reply once it's generated
         user_message = Message(
             chat_id=chat_id,
             role="user",
             content=chat_request.message
         )
-        session.add(user_message)
-        session.commit()
         
-        # Get chat history
-        chat_history = session.exec(
-            select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at)
-        ).all()
+        rag_service = request.app.state.rag
         
-        # Convert to format expected by RAG service
-        history = [
-            {"role": msg.role, "content": msg.content}
-            for msg in chat_history[:-1]  # Exclude the current user message
-        ]
-        
-        # Retrieve relevant chunks
-        embedder = EmbeddingService()
-        vector_index = VectorIndex()
-        
-        # Embed the query
-        query_embedding = embedder.embed_text(chat_request.message)
-        
-        # Search for relevant chunks
-        collection_name = f"bot_{bot.id}"
-        retrieved_chunks = vector_index.search(
-            collection_name, 
-            query_embedding, 
-            top_k=8
-        )
+        # Retrieve relevant chunks (skipped for small talk that needs no context)
+        retrieved_chunks = []
+        if rag_service.should_retrieve(chat_request.message):
+            embedder = request.app.state.embedder
+            vector_index = request.app.state.vector_index
+            
+            # Embed the query
+            query_embedding = await run_in_threadpool(_embed_query, embedder, chat_request.message)
+            
+            # Search for relevant chunks
+            collection_name = f"bot_{bot_id}"
+            retrieved_chunks = await run_in_threadpool(
+                vector_index.search,
+                collection_name, 
+                query_embedding, 
+                top_k=8
+            )
         
         if not retrieved_chunks:
             # No relevant chunks found
@@ -80,23 +68,25 @@ async def chat_with_bot(
             sources = []
         else:
             # Generate response using RAG
-            rag_service = RAGService()
-            
-            # Create a generator for streaming
-            def generate_response():
+            # Async generator: Ollama I/O is awaited on the event loop, so
+            # concurrent streams don't each hold a threadpool thread
+            async def generate_response():
                 response_text = ""
-                for chunk in rag_service.generate_response(
+                async for chunk in rag_service.generate_response(
                     chat_request.message, retrieved_chunks, history
                 ):
                     response_text += chunk
-                    yield f"data: {json.dumps({'chunk': chunk})}\n\n"
+                    yield b"data: " + orjson.dumps({'chunk': chunk}) + b"\n\n"
                 
                 # Extract citations
                 citations = rag_service.extract_citations(response_text, retrieved_chunks)
                 sources = rag_service.format_sources(citations)
                 
                 # Send final data with sources
-                yield f"data: {json.dumps({'done': True, 'sources': sources})}\n\n"
+                yield b"data: " + orjson.dumps({'done': True, 'sources': sources}) + b"\n\n"
+                
+                # Persist the whole turn in a single commit
+                await run_in_threadpool(_save_turn, user_message, response_text, sources)
             
             return StreamingResponse(
                 generate_response(),
@@ -107,19 +97,8 @@ async def chat_with_bot(
                 }
             )
         
-        # For non-streaming fallback
-        response_text = "I cannot find information about this in the provided documents."
-        sources = []
-        
-        # Save assistant message
-        assistant_message = Message(
-            chat_id=chat_id,
-            role="assistant",
-            content=response_text,
-            sources=sources
-        )
-        session.add(assistant_message)
-        session.commit()
+        # Non-streaming fallback: persist the whole turn in a single commit
+        await run_in_threadpool(_save_turn, user_message, response_text, sources)
         
         return ChatResponse(
             message=response_text,
@@ -134,26 +113,86 @@ async def chat_with_bot(
         raise HTTPException(status_code=500, detail=f"Error in chat: {str(e)}")
 
 
+def _prepare_chat(session: Session, slug: str, chat_request: ChatRequest):
+    """Resolve the bot and chat and load recent history"""
+    # Get bot by slug
+    bot = resolve_bot_or_404(session, slug)
+    
+    # Get or create chat
+    chat_id = chat_request.chat_id
+    if not chat_id:
+        chat = Chat(bot_id=bot.id)
+        session.add(chat)
+        session.commit()
+        session.refresh(chat)
+        chat_id = chat.id
+    else:
+        chat = session.get(Chat, chat_id)
+        if not chat or chat.bot_id != bot.id:
+            raise HTTPException(status_code=404, detail="Chat not found")
+    
+    # Get the most recent chat history
+    history_rows = session.exec(
+        select(Message)
+        .where(Message.chat_id == chat_id)
+        .order_by(Message.created_at.desc())
+        .limit(settings.chat_history_limit)
+    ).all()
+    
+    # Convert to format expected by RAG service (oldest first)
+    history = [
+        {"role": msg.role, "content": msg.content}
+        for msg in reversed(history_rows)
+    ]
+    
+    return bot.id, chat_id, history
+
+
+def _save_turn(user_message: Message, response_text: str, sources: List[Dict[str, Any]]):
+    """Save the user message and the assistant reply in one transaction"""
+    assistant_message = Message(
+        chat_id=user_message.chat_id,
+        role="assistant",
+        content=response_text,
+        sources=json.dumps(sources)
+    )
+    
+    # Uses its own session: the request session is closed once streaming starts
+    with Session(engine, binds=SESSION_BINDS) as session:
+        session.add_all([user_message, assistant_message])
+        session.commit()
+
+
+def _embed_query(embedder, message: str) -> np.ndarray:
+    """Embed a chat query, reusing the cached vector for repeated messages"""
+    key = hashlib.blake2b(" ".join(message.split()).encode(), digest_size=16).digest()
+    
+    with _embed_cache_lock:
+        embedding = _embed_cache.get(key)
+    
+    if embedding is None:
+        embedding = embedder.embed_text(message)
+        with _embed_cache_lock:
+            _embed_cache[key] = embedding
+    
+    return embedding
+
+
 @router.get("/{slug}/history")
 def get_chat_history(slug: str, chat_id: int, session: Session = Depends(get_session)):
     """Get chat history"""
     try:
         # Get bot by slug
-        bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
+        bot = resolve_bot_or_404(session, slug)
         
-        # Get chat
-        chat = session.get(Chat, chat_id)
+        # Get chat with its messages in one round of loading
+        chat = session.exec(
+            select(Chat).options(selectinload(Chat.messages)).where(Chat.id == chat_id)
+        ).first()
         if not chat or chat.bot_id != bot.id:
             raise HTTPException(status_code=404, detail="Chat not found")
         
-        # Get messages
-        messages = session.exec(
-            select(Message).where(Message.chat_id == chat_id).order_by(Message.created_at)
-        ).all()
-        
-        return messages
+        return chat.messages
         
     except HTTPException:
         raise
@@ -166,9 +205,7 @@ def list_chats(slug: str, session: Session = Depends(get_session)):
     """List all chats for a bot"""
     try:
         # Get bot by slug
-        bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
+        bot = resolve_bot_or_404(session, slug)
         
         # Get chats
         chats = session.exec(
@@ -188,9 +225,7 @@ def delete_chat(slug: str, chat_id: int, session: Session = Depends(get_session)
     """Delete a chat"""
     try:
         # Get bot by slug
-        bot = session.exec(select(Bot).where(Bot.slug == slug)).first()
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
+        bot = resolve_bot_or_404(session, slug)
         
         # Get chat
         chat = session.get(Chat, chat_id)
@@ -1,8 +1,12 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+import aiofiles
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlmodel import Session, select
-from ..deps import get_session
-from ..models import Bot, UrlSource, UrlSourceCreate, UrlSourceRead, UploadResponse
+from ..deps import engine, get_session
+from ..models import Bot, Chunk, Document, UrlSource, UrlSourceCreate, UrlSourceRead, UploadResponse
+from ..utils.status_cache import status_cache
 from ..utils.tasks import task_manager
 
 router = APIRouter(prefix="/bots", tags=["ingest"])
@@ -12,6 +16,7 @@ router = APIRouter(prefix="/bots", tags=["ingest"])
 async def add_urls(
     bot_id: int,
     url_data: UrlSourceCreate,
+    request: Request,
     session: Session = Depends(get_session)
 ):
     """Add URLs for crawling"""
@@ -31,99 +36,76 @@ async def add_urls(
         session.add(url_source)
         session.commit()
         session.refresh(url_source)
+        status_cache.invalidate(bot_id)
         
         # Start background processing
+        url_source_id = url_source.id
+        root_url, depth = url_source.root_url, url_source.depth
+        
         async def process_url_task():
-            from ..services.crawl import WebCrawler
-            from ..services.chunking import SemanticChunker
-            from ..services.embed import EmbeddingService
-            from ..services.index import VectorIndex
-            from ..models import Document, Chunk
+            from ..services.chunking import semantic_chunker
             
+            # The request's session is not used here: the work below runs in
+            # short sessions of its own, so no transaction spans the crawl,
+            # chunking or embedding
+            document_id = None
             try:
                 # Crawl URL
-                crawler = WebCrawler()
-                crawled_data = await crawler.crawl_url(url_source.root_url, url_source.depth)
+                crawler = request.app.state.crawler
+                crawled_data = await crawler.crawl_url(root_url, depth)
                 
                 # Process crawled content
                 content_text = crawler.process_crawled_content(crawled_data)
                 
-                # Create a virtual document for the crawled content
-                document = Document(
-                    bot_id=bot_id,
-                    filename=f"crawled_{url_source.id}.txt",
-                    filetype=".txt",
-                    path_original=f"crawled_{url_source.id}.txt",
-                    path_parsed=f"crawled_{url_source.id}.txt",
-                    pages=1,
-                    status="CHUNKING",
-                    metadata={
-                        'source_type': 'crawled',
-                        'root_url': url_source.root_url,
-                        'crawled_urls': len(crawled_data['crawled_urls']),
-                        'depth': url_source.depth
-                    }
+                # Commit the virtual document first: chunk ids and vectors are
+                # keyed by its id, which must not be handed out again
+                document_id, parsed_path = await asyncio.to_thread(
+                    _create_crawled_document, bot_id, url_source_id, root_url, depth,
+                    len(crawled_data['crawled_urls'])
                 )
                 
-                session.add(document)
-                session.commit()
-                
-                # Save crawled content
-                with open(document.path_parsed, 'w', encoding='utf-8') as f:
-                    f.write(content_text)
+                # Save crawled content without blocking the event loop
+                async with aiofiles.open(parsed_path, 'w', encoding='utf-8') as f:
+                    await f.write(content_text)
                 
-                # Chunk content
-                chunker = SemanticChunker()
-                chunks_data = chunker.chunk_text(content_text, {
-                    'document_id': document.id,
+                # Chunk content (CPU-bound, kept off the event loop)
+                chunks_data = await asyncio.to_thread(semantic_chunker.chunk_text, content_text, {
+                    'document_id': document_id,
                     'source_type': 'crawled'
                 })
                 
-                # Create chunk records
-                chunks = []
-                for chunk_data in chunks_data:
-                    chunk = Chunk(
-                        bot_id=bot_id,
-                        document_id=document.id,
-                        chunk_id=chunk_data['chunk_id'],
-                        text=chunk_data['text'],
-                        location=chunk_data['location'],
-                        headings=chunk_data['headings']
-                    )
-                    chunks.append(chunk)
-                
-                session.add_all(chunks)
-                document.status = "EMBEDDING"
-                session.commit()
-                
-                # Embed chunks
-                embedder = EmbeddingService()
-                embedded_chunks = embedder.embed_chunks(chunks_data)
+                # Embed chunks (encode and FAISS hold the GIL or block, so they
+                # run in worker threads while other requests are served)
+                embedder = request.app.state.embedder
+                embedded_chunks = await asyncio.to_thread(embedder.embed_chunks, chunks_data)
                 
                 # Index chunks
-                vector_index = VectorIndex()
+                vector_index = request.app.state.vector_index
                 collection_name = f"bot_{bot_id}"
                 embedding_dim = embedder.get_embedding_dimension()
-                vector_index.create_collection(collection_name, embedding_dim)
-                vector_index.add_chunks(collection_name, embedded_chunks)
+                await asyncio.to_thread(vector_index.create_collection, collection_name, embedding_dim)
+                await asyncio.to_thread(vector_index.add_chunks, collection_name, embedded_chunks)
                 
-                # Update statuses
-                document.status = "DONE"
-                url_source.status = "DONE"
-                url_source.fetched_urls = [url['url'] for url in crawled_data['crawled_urls']]
-                session.commit()
+                # Chunk records and both statuses go in one short transaction
+                await asyncio.to_thread(
+                    _finish_url_source, bot_id, url_source_id, document_id, chunks_data,
+                    [url['url'] for url in crawled_data['crawled_urls']]
+                )
+                status_cache.invalidate(bot_id)
                 
                 return {
                     'status': 'success',
-                    'url_source_id': url_source.id,
-                    'document_id': document.id,
-                    'chunks_created': len(chunks),
+                    'url_source_id': url_source_id,
+                    'document_id': document_id,
+                    'chunks_created': len(chunks_data),
                     'urls_crawled': len(crawled_data['crawled_urls'])
                 }
                 
             except Exception as e:
-                url_source.status = "ERROR"
-                session.commit()
+                # The failed document keeps its id reserved, so vectors already
+                # indexed under it can't be attributed to another document
+                await asyncio.to_thread(_mark_url_source_failed, url_source_id, document_id)
+                status_cache.invalidate(bot_id)
                 raise e
         
         task_id = await task_manager.submit_task(
@@ -145,6 +127,72 @@ async def add_urls(
         raise HTTPException(status_code=500, detail=f"Error adding URL: {str(e)}")
 
 
+def _create_crawled_document(bot_id: int, url_source_id: int, root_url: str,
+                             depth: int, crawled_count: int):
+    """Commit the virtual document holding a crawl's content; returns its id and text path"""
+    document = Document(
+        bot_id=bot_id,
+        filename=f"crawled_{url_source_id}.txt",
+        filetype=".txt",
+        path_original=f"crawled_{url_source_id}.txt",
+        path_parsed=f"crawled_{url_source_id}.txt",
+        pages=1,
+        status="PENDING",
+        doc_metadata=json.dumps({
+            'source_type': 'crawled',
+            'root_url': root_url,
+            'crawled_urls': crawled_count,
+            'depth': depth
+        }, separators=(',', ':'))
+    )
+    with Session(engine, expire_on_commit=False) as session:
+        session.add(document)
+        session.commit()
+        return document.id, document.path_parsed
+
+
+def _finish_url_source(bot_id: int, url_source_id: int, document_id: int,
+                       chunks_data: List[dict], fetched_urls: List[str]):
+    """Insert a crawl's chunk records and mark it DONE in one transaction"""
+    with Session(engine) as session:
+        document = session.get(Document, document_id)
+        url_source = session.get(UrlSource, url_source_id)
+        if not document or not url_source:
+            raise ValueError(f"URL source {url_source_id} or its document was deleted")
+        
+        # Bulk insert chunk records (skips per-object unit-of-work overhead)
+        session.bulk_insert_mappings(Chunk, [
+            {
+                'bot_id': bot_id,
+                'document_id': document_id,
+                'chunk_id': chunk_data['chunk_id'],
+                'text': chunk_data['text'],
+                'location': json.dumps(chunk_data['location']),
+                'headings': json.dumps(chunk_data['headings'])
+            }
+            for chunk_data in chunks_data
+        ])
+        
+        # Update statuses
+        document.status = "DONE"
+        url_source.status = "DONE"
+        url_source.fetched_urls = json.dumps(fetched_urls)
+        session.commit()
+
+
+def _mark_url_source_failed(url_source_id: int, document_id: Optional[int]):
+    """Record a failed crawl on its URL source and, once created, its document"""
+    with Session(engine) as session:
+        url_source = session.get(UrlSource, url_source_id)
+        if url_source:
+            url_source.status = "ERROR"
+        if document_id is not None:
+            document = session.get(Document, document_id)
+            if document:
+                document.status = "ERROR"
+        session.commit()
+
+
 @router.get("/{bot_id}/urls", response_model=List[UrlSourceRead])
 def list_urls(bot_id: int, session: Session = Depends(get_session)):
     """List all URL sources for a bot"""
@@ -183,6 +231,7 @@ def delete_url(bot_id: int, url_id: int, session: Session = Depends(get_session)
         # Delete URL source
         session.delete(url_source)
         session.commit()
+        status_cache.invalidate(bot_id)
         
         return {"message": "URL source deleted successfully"}
         
@@ -1,78 +1,41 @@
-from typing import List, Dict, Any
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from ..deps import get_session
+import hashlib
+import orjson
+from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from sqlalchemy import JSON, cast
+from sqlmodel import Session, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ..deps import get_async_session, get_session
 from ..models import Bot, Document, UrlSource, StatusResponse
+from ..utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, set_next_cursor, split_page
+from ..utils.status_cache import status_cache
 from ..utils.tasks import task_manager
 
 router = APIRouter(prefix="/bots", tags=["status"])
 
 
 @router.get("/{bot_id}/status", response_model=StatusResponse)
-def get_bot_status(bot_id: int, session: Session = Depends(get_session)):
+async def get_bot_status(
+    bot_id: int,
+    request: Request,
+    response: Response,
+    session: AsyncSession = Depends(get_async_session)
+):
     """Get the status of all documents and URLs for a bot"""
     try:
-        # Check if bot exists
-        bot = session.get(Bot, bot_id)
-        if not bot:
-            raise HTTPException(status_code=404, detail="Bot not found")
-        
-        # Get documents
-        documents = session.exec(
-            select(Document).where(Document.bot_id == bot_id)
-        ).all()
-        
-        # Get URL sources
-        url_sources = session.exec(
-            select(UrlSource).where(UrlSource.bot_id == bot_id)
-        ).all()
-        
-        # Calculate overall status
-        total_items = len(documents) + len(url_sources)
-        if total_items == 0:
-            return StatusResponse(
-                status="NO_CONTENT",
-                progress=100,
-                message="No documents or URLs added yet"
-            )
+        # Serve repeated polls from the short-lived cache
+        payload = status_cache.get(bot_id, "bot")
+        if payload is None:
+            payload = (await _compute_bot_status(session, bot_id)).model_dump()
+            status_cache.set(bot_id, "bot", payload)
         
-        completed_items = 0
-        error_items = 0
-        pending_items = 0
+        # Pollers that already have this status get an empty 304
+        etag = _status_etag(payload)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
         
-        for doc in documents:
-            if doc.status == "DONE":
-                completed_items += 1
-            elif doc.status == "ERROR":
-                error_items += 1
-            else:
-                pending_items += 1
-        
-        for url in url_sources:
-            if url.status == "DONE":
-                completed_items += 1
-            elif url.status == "ERROR":
-                error_items += 1
-            else:
-                pending_items += 1
-        
-        progress = (completed_items / total_items) * 100 if total_items > 0 else 0
-        
-        if error_items > 0:
-            status = "ERROR"
-            message = f"{error_items} items failed, {completed_items} completed"
-        elif pending_items > 0:
-            status = "PROCESSING"
-            message = f"{pending_items} items processing, {completed_items} completed"
-        else:
-            status = "DONE"
-            message = f"All {completed_items} items completed"
-        
-        return StatusResponse(
-            status=status,
-            progress=progress,
-            message=message
-        )
+        response.headers["ETag"] = etag
+        return StatusResponse(**payload)
         
     except HTTPException:
         raise
@@ -80,6 +43,61 @@ def get_bot_status(bot_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=500, detail=f"Error getting bot status: {str(e)}")
 
 
+async def _compute_bot_status(session: AsyncSession, bot_id: int) -> StatusResponse:
+    """Aggregate document and URL statuses for a bot"""
+    # Check if bot exists
+    bot = await session.get(Bot, bot_id)
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    
+    # Count statuses in SQL instead of loading every row
+    status_counts: Dict[str, int] = {}
+    for model in (Document, UrlSource):
+        rows = (await session.exec(
+            select(model.status, func.count())
+            .where(model.bot_id == bot_id)
+            .group_by(model.status)
+        )).all()
+        for item_status, count in rows:
+            status_counts[item_status] = status_counts.get(item_status, 0) + count
+    
+    # Calculate overall status
+    total_items = sum(status_counts.values())
+    if total_items == 0:
+        return StatusResponse(
+            status="NO_CONTENT",
+            progress=100,
+            message="No documents or URLs added yet"
+        )
+    
+    completed_items = status_counts.get("DONE", 0)
+    error_items = status_counts.get("ERROR", 0)
+    pending_items = total_items - completed_items - error_items
+    
+    progress = (completed_items / total_items) * 100 if total_items > 0 else 0
+    
+    if error_items > 0:
+        status = "ERROR"
+        message = f"{error_items} items failed, {completed_items} completed"
+    elif pending_items > 0:
+        status = "PROCESSING"
+        message = f"{pending_items} items processing, {completed_items} completed"
+    else:
+        status = "DONE"
+        message = f"All {completed_items} items completed"
+    
+    return StatusResponse(
+        status=status,
+        progress=progress,
+        message=message
+    )
+
+
+def _status_etag(payload: Dict[str, Any]) -> str:
+    """Weak ETag over a status payload"""
+    return f'W/"{hashlib.blake2b(orjson.dumps(payload), digest_size=8).hexdigest()}"'
+
+
 @router.get("/task/{task_id}", response_model=StatusResponse)
 def get_task_status_endpoint(task_id: str, session: Session = Depends(get_session)):
     """Get the status of a specific task"""
@@ -88,6 +106,10 @@ def get_task_status_endpoint(task_id: str, session: Session = Depends(get_sessio
         if not status_data:
             raise HTTPException(status_code=404, detail="Task not found")
         
+        # Upload batches report aggregate progress over their child tasks
+        if status_data['type'] == "upload_batch":
+            return _batch_status(task_manager.get_batch_counts(task_id, session))
+        
         return StatusResponse(
             status=status_data['status'],
             progress=100 if status_data['status'] == 'COMPLETED' else 0,
@@ -99,30 +121,70 @@ def get_task_status_endpoint(task_id: str, session: Session = Depends(get_sessio
         raise HTTPException(status_code=500, detail=f"Error getting task status: {str(e)}")
 
 
+def _batch_status(counts: Dict[str, int]) -> StatusResponse:
+    """Summarize a batch from its child task status counts"""
+    total = sum(counts.values())
+    completed = counts.get("COMPLETED", 0)
+    failed = counts.get("FAILED", 0) + counts.get("CANCELLED", 0)
+    pending = total - completed - failed
+    
+    if pending > 0:
+        status = "RUNNING"
+    elif failed > 0:
+        status = "FAILED"
+    else:
+        status = "COMPLETED"
+    
+    return StatusResponse(
+        status=status,
+        progress=(completed / total) * 100 if total > 0 else 0,
+        message=f"{completed} of {total} tasks completed, {failed} failed"
+    )
+
+
 @router.get("/{bot_id}/documents/status")
-def get_documents_status(bot_id: int, session: Session = Depends(get_session)):
-    """Get detailed status of all documents for a bot"""
+async def get_documents_status(
+    bot_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Get detailed status of a page of documents for a bot (newest first)"""
     try:
+        cache_kind = f"documents:{cursor}:{limit}"
+        cached = status_cache.get(bot_id, cache_kind)
+        if cached is not None:
+            set_next_cursor(response, cached["next_cursor"])
+            return cached["items"]
+        
         # Check if bot exists
-        bot = session.get(Bot, bot_id)
+        bot = await session.get(Bot, bot_id)
         if not bot:
             raise HTTPException(status_code=404, detail="Bot not found")
         
-        # Get documents with status
-        documents = session.exec(
-            select(Document).where(Document.bot_id == bot_id).order_by(Document.created_at.desc())
-        ).all()
+        # Get documents with status (only the listed columns, no ORM objects)
+        documents, next_cursor = split_page((await session.exec(keyset_page(
+            select(Document.id, Document.filename, Document.status, Document.created_at, Document.pages)
+            .where(Document.bot_id == bot_id),  # Keyset pages ordered by id
+            Document.id, limit, cursor
+        ))).all(), limit)
         
-        return [
+        # Documents still PENDING in the database may have an in-flight state
+        progress = status_cache.get_progress(bot_id)
+        documents_status = [
             {
                 "id": doc.id,
                 "filename": doc.filename,
-                "status": doc.status,
+                "status": progress.get(doc.id, doc.status) if doc.status == "PENDING" else doc.status,
                 "created_at": doc.created_at,
                 "pages": doc.pages
             }
             for doc in documents
         ]
+        status_cache.set(bot_id, cache_kind, {"items": documents_status, "next_cursor": next_cursor})
+        set_next_cursor(response, next_cursor)
+        return documents_status
         
     except HTTPException:
         raise
@@ -130,30 +192,60 @@ def get_documents_status(bot_id: int, session: Session = Depends(get_session)):
         raise HTTPException(status_code=500, detail=f"Error getting documents status: {str(e)}")
 
 
+def _fetched_urls_count(dialect_name: str):
+    """SQL expression counting a URL source's fetched_urls JSON array"""
+    fetched_urls = UrlSource.fetched_urls
+    if dialect_name == "postgresql":
+        # Postgres only has json_array_length(json); the column is TEXT
+        fetched_urls = cast(fetched_urls, JSON)
+    return func.coalesce(func.json_array_length(fetched_urls), 0)
+
+
 @router.get("/{bot_id}/urls/status")
-def get_urls_status(bot_id: int, session: Session = Depends(get_session)):
-    """Get detailed status of all URL sources for a bot"""
+async def get_urls_status(
+    bot_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None),
+    session: AsyncSession = Depends(get_async_session)
+):
+    """Get detailed status of a page of URL sources for a bot (newest first)"""
     try:
+        cache_kind = f"urls:{cursor}:{limit}"
+        cached = status_cache.get(bot_id, cache_kind)
+        if cached is not None:
+            set_next_cursor(response, cached["next_cursor"])
+            return cached["items"]
+        
         # Check if bot exists
-        bot = session.get(Bot, bot_id)
+        bot = await session.get(Bot, bot_id)
         if not bot:
             raise HTTPException(status_code=404, detail="Bot not found")
         
-        # Get URL sources with status
-        url_sources = session.exec(
-            select(UrlSource).where(UrlSource.bot_id == bot_id).order_by(UrlSource.created_at.desc())
-        ).all()
+        # Get URL sources with status (only the listed columns, no ORM objects)
+        url_sources, next_cursor = split_page((await session.exec(keyset_page(
+            select(
+                UrlSource.id, UrlSource.root_url, UrlSource.status, UrlSource.created_at,
+                # Count the stored JSON array in SQL instead of shipping and parsing it
+                _fetched_urls_count(session.bind.dialect.name).label("fetched_urls_count")
+            )
+            .where(UrlSource.bot_id == bot_id),  # Keyset pages ordered by id
+            UrlSource.id, limit, cursor
+        ))).all(), limit)
         
-        return [
+        urls_status = [
             {
                 "id": url.id,
                 "root_url": url.root_url,
                 "status": url.status,
                 "created_at": url.created_at,
-                "fetched_urls_count": len(url.fetched_urls) if url.fetched_urls else 0
+                "fetched_urls_count": url.fetched_urls_count
             }
             for url in url_sources
         ]
+        status_cache.set(bot_id, cache_kind, {"items": urls_status, "next_cursor": next_cursor})
+        set_next_cursor(response, next_cursor)
+        return urls_status
         
     except HTTPException:
         raise
@@ -1,19 +1,44 @@
+import asyncio
+import functools
+import json
+import multiprocessing
 import os
-import shutil
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+import re
+import uuid
+import aiofiles
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File, Form
+from sqlalchemy import delete
 from sqlmodel import Session, select
-from ..deps import get_session
+from ..deps import SESSION_BINDS, engine, get_session
 from ..models import Document, DocumentCreate, DocumentRead, UploadResponse
 from ..config import settings
+from ..utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_page, set_next_cursor, split_page
+from ..utils.status_cache import status_cache
 from ..utils.tasks import task_manager
 
 router = APIRouter(prefix="/bots", tags=["uploads"])
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1MB
+
+_CHUNK_POOL = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="chunking")
+
+# Parsing is CPU-bound Python (PDF text, OCR, spreadsheets), so documents parse in
+# separate processes rather than serializing on the GIL. Workers are spawned, not
+# forked: they start lazily, after torch/FAISS have started threads in this process
+_PARSE_POOL = ProcessPoolExecutor(
+    max_workers=max((os.cpu_count() or 2) - 1, 1),
+    mp_context=multiprocessing.get_context("spawn")
+)
+
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\-_\.]')
+
 
 @router.post("/{bot_id}/add-docs", response_model=UploadResponse)
 async def upload_documents(
     bot_id: int,
+    request: Request,
     files: List[UploadFile] = File(...),
     session: Session = Depends(get_session)
 ):
@@ -32,129 +57,71 @@ async def upload_documents(
         if len(files) > 10:  # Limit number of files
             raise HTTPException(status_code=400, detail="Too many files (max 10)")
         
-        # Process each file
-        task_ids = []
+        # Validate each file and pick its storage path before writing anything
+        saved_files = []
         for file in files:
             # Validate file type
-            file_ext = os.path.splitext(file.filename)[1].lower()
+            file_ext = os.path.splitext(file.filename or "")[1].lower()
             if file_ext not in settings.allowed_extensions:
                 raise HTTPException(
                     status_code=400, 
                     detail=f"File type {file_ext} not allowed. Allowed: {settings.allowed_extensions}"
                 )
             
-            # Check file size
-            if file.size > settings.max_file_size:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File {file.filename} too large (max {settings.max_file_size / 1024 / 1024}MB)"
-                )
+            # Check file size (clients may omit it; _save_upload enforces the cap while streaming)
+            if file.size is not None and file.size > settings.max_file_size:
+                raise _file_too_large(file.filename)
             
             # Sanitize filename
             safe_filename = _sanitize_filename(file.filename)
             file_path = os.path.join(settings.upload_dir, f"{bot_id}_{safe_filename}")
-            
-            # Save file
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # Create document record
-            document = Document(
+            saved_files.append((file, safe_filename, file_ext, file_path))
+        
+        # Save files concurrently without blocking the event loop
+        results = await asyncio.gather(*[
+            _save_upload(file, file_path) for file, _, _, file_path in saved_files
+        ], return_exceptions=True)
+        
+        # If any file failed (e.g. it exceeded the size cap), keep none of the batch
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for _, _, _, file_path in saved_files:
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+            raise errors[0]
+        
+        # Create all document records in a single transaction
+        documents = [
+            Document(
                 bot_id=bot_id,
                 filename=safe_filename,
                 filetype=file_ext,
                 path_original=file_path,
                 status="PENDING"
             )
-            
-            session.add(document)
-            session.commit()
-            session.refresh(document)
-            
-            # Start background processing
-            async def process_doc():
-                from ..services.parsing import DocumentParser
-                from ..services.chunking import SemanticChunker
-                from ..services.embed import EmbeddingService
-                from ..services.index import VectorIndex
-                
-                try:
-                    # Parse document
-                    parser = DocumentParser()
-                    parsed_data = parser.parse_document(document.path_original, document.filetype)
-                    
-                    # Save parsed content
-                    parsed_path = f"{document.path_original}.parsed.txt"
-                    with open(parsed_path, 'w', encoding='utf-8') as f:
-                        f.write(parsed_data['text'])
-                    
-                    document.path_parsed = parsed_path
-                    document.pages = parsed_data.get('pages', 1)
-                    document.metadata.update(parsed_data.get('metadata', {}))
-                    document.status = "CHUNKING"
-                    session.commit()
-                    
-                    # Chunk document
-                    chunker = SemanticChunker()
-                    chunks_data = chunker.chunk_text(parsed_data['text'], {
-                        'document_id': document.id,
-                        'page_content': parsed_data.get('page_content', [])
-                    })
-                    
-                    # Create chunk records
-                    chunks = []
-                    for chunk_data in chunks_data:
-                        chunk = Chunk(
-                            bot_id=bot_id,
-                            document_id=document.id,
-                            chunk_id=chunk_data['chunk_id'],
-                            text=chunk_data['text'],
-                            location=chunk_data['location'],
-                            headings=chunk_data['headings']
-                        )
-                        chunks.append(chunk)
-                    
-                    session.add_all(chunks)
-                    document.status = "EMBEDDING"
-                    session.commit()
-                    
-                    # Embed chunks
-                    embedder = EmbeddingService()
-                    embedded_chunks = embedder.embed_chunks(chunks_data)
-                    
-                    # Index chunks
-                    vector_index = VectorIndex()
-                    collection_name = f"bot_{bot_id}"
-                    embedding_dim = embedder.get_embedding_dimension()
-                    vector_index.create_collection(collection_name, embedding_dim)
-                    vector_index.add_chunks(collection_name, embedded_chunks)
-                    
-                    # Update document status
-                    document.status = "DONE"
-                    session.commit()
-                    
-                    return {
-                        'status': 'success',
-                        'document_id': document.id,
-                        'chunks_created': len(chunks),
-                        'collection': collection_name
-                    }
-                    
-                except Exception as e:
-                    document.status = "ERROR"
-                    session.commit()
-                    raise e
-            
-            task_id = await task_manager.submit_task(
+            for _, safe_filename, file_ext, file_path in saved_files
+        ]
+        session.add_all(documents)
+        session.commit()
+        status_cache.invalidate(bot_id)
+        
+        # Process each file in the background, grouped under one pollable batch task.
+        # Largest files start first so the longest parses don't finish last
+        batch_id = task_manager.create_batch(
+            "upload_batch", {"bot_id": bot_id, "documents": len(documents)}, session
+        )
+        for document in documents:
+            await task_manager.submit_task(
                 "process_document",
                 {"document_id": document.id, "bot_id": bot_id},
-                process_doc,
-                session
+                functools.partial(process_document, request.app, document.id, bot_id),
+                session,
+                parent_id=batch_id,
+                priority=-os.path.getsize(document.path_original)
             )
-            task_ids.append(task_id)
         
         return UploadResponse(
-            task_id=",".join(task_ids),
+            task_id=batch_id,
             message=f"Uploaded {len(files)} documents. Processing started."
         )
         
@@ -166,8 +133,14 @@ async def upload_documents(
 
 
 @router.get("/{bot_id}/documents", response_model=List[DocumentRead])
-def list_documents(bot_id: int, session: Session = Depends(get_session)):
-    """List all documents for a bot"""
+def list_documents(
+    bot_id: int,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[int] = Query(None),
+    session: Session = Depends(get_session)
+):
+    """List a page of documents for a bot (newest first)"""
     try:
         # Check if bot exists
         from ..models import Bot
@@ -175,10 +148,12 @@ def list_documents(bot_id: int, session: Session = Depends(get_session)):
         if not bot:
             raise HTTPException(status_code=404, detail="Bot not found")
         
-        documents = session.exec(
-            select(Document).where(Document.bot_id == bot_id).order_by(Document.created_at.desc())
-        ).all()
+        documents, next_cursor = split_page(session.exec(keyset_page(
+            select(Document).where(Document.bot_id == bot_id),
+            Document.id, limit, cursor
+        )).all(), limit)
         
+        set_next_cursor(response, next_cursor)
         return documents
         
     except HTTPException:
@@ -202,11 +177,9 @@ def delete_document(bot_id: int, document_id: int, session: Session = Depends(ge
         if not document or document.bot_id != bot_id:
             raise HTTPException(status_code=404, detail="Document not found")
         
-        # Delete associated chunks
+        # Delete associated chunks in a single statement
         from ..models import Chunk
-        chunks = session.exec(select(Chunk).where(Chunk.document_id == document_id)).all()
-        for chunk in chunks:
-            session.delete(chunk)
+        session.exec(delete(Chunk).where(Chunk.document_id == document_id))
         
         # Delete files
         if document.path_original and os.path.exists(document.path_original):
@@ -217,6 +190,7 @@ def delete_document(bot_id: int, document_id: int, session: Session = Depends(ge
         # Delete document
         session.delete(document)
         session.commit()
+        status_cache.invalidate(bot_id)
         
         return {"message": "Document deleted successfully"}
         
@@ -227,16 +201,188 @@ def delete_document(bot_id: int, document_id: int, session: Session = Depends(ge
         raise HTTPException(status_code=500, detail=f"Error deleting document: {str(e)}")
 
 
+async def process_document(app, document_id: int, bot_id: int):
+    """Parse, chunk, embed and index an uploaded document"""
+    from ..services.parsing import parse_document_file
+    from ..services.chunking import semantic_chunker
+    from ..services.chunk_cache import chunk_cache
+    
+    # Background work uses its own short sessions rather than the (finished)
+    # request's; nothing holds a database transaction while parsing or embedding
+    path_original, filetype = await asyncio.to_thread(_load_document_source, document_id)
+    
+    try:
+        # Parse document
+        parsed_data = await asyncio.get_running_loop().run_in_executor(
+            _PARSE_POOL, parse_document_file, path_original, filetype
+        )
+        
+        # Save parsed content without blocking the event loop
+        parsed_path = f"{path_original}.parsed.txt"
+        async with aiofiles.open(parsed_path, 'w', encoding='utf-8') as f:
+            await f.write(parsed_data['text'])
+        
+        # Intermediate states only go to the status cache; the database
+        # is written once, on the terminal state
+        status_cache.set_progress(bot_id, document_id, "CHUNKING")
+        
+        # Previously seen content reuses its cached chunks and embeddings
+        cached_chunks = None
+        if settings.enable_chunk_cache:
+            cache_key = await asyncio.to_thread(chunk_cache.key_for, parsed_path, parsed_data)
+            cached_chunks = await asyncio.to_thread(chunk_cache.get, cache_key, document_id)
+        
+        if cached_chunks is not None:
+            chunks_data = cached_chunks
+        else:
+            # Chunk document off the event loop (tiktoken releases the GIL,
+            # so threads avoid process-pool pickling)
+            chunks_data = await asyncio.get_running_loop().run_in_executor(
+                _CHUNK_POOL, semantic_chunker.chunk_text, parsed_data['text'], {
+                    'document_id': document_id,
+                    'page_content': parsed_data.get('page_content', [])
+                }
+            )
+        status_cache.set_progress(bot_id, document_id, "EMBEDDING")
+        
+        # Embed and index chunks, overlapping the two phases
+        embedder = app.state.embedder
+        vector_index = app.state.vector_index
+        collection_name = f"bot_{bot_id}"
+        embedding_dim = embedder.get_embedding_dimension()
+        await asyncio.to_thread(vector_index.create_collection, collection_name, embedding_dim)
+        if cached_chunks is not None:
+            await asyncio.to_thread(vector_index.add_chunks, collection_name, chunks_data)
+        else:
+            await _embed_and_index(embedder, vector_index, collection_name, chunks_data)
+            if settings.enable_chunk_cache:
+                await asyncio.to_thread(chunk_cache.set, cache_key, document_id, chunks_data)
+        
+        # Chunk records and the DONE status go in one short transaction
+        await asyncio.to_thread(
+            _finish_document, document_id, bot_id, chunks_data, parsed_path,
+            parsed_data.get('pages', 1), parsed_data.get('metadata', {})
+        )
+        status_cache.clear_progress(bot_id, document_id)
+        status_cache.invalidate(bot_id)
+        
+        return {
+            'status': 'success',
+            'document_id': document_id,
+            'chunks_created': len(chunks_data),
+            'collection': collection_name
+        }
+        
+    except Exception as e:
+        await asyncio.to_thread(_set_document_status, document_id, "ERROR")
+        status_cache.clear_progress(bot_id, document_id)
+        status_cache.invalidate(bot_id)
+        raise e
+
+
+def _load_document_source(document_id: int):
+    """Read the stored file path and type of a document"""
+    with Session(engine, binds=SESSION_BINDS) as session:
+        document = session.get(Document, document_id)
+        if not document:
+            raise ValueError(f"Document {document_id} not found")
+        return document.path_original, document.filetype
+
+
+def _finish_document(document_id: int, bot_id: int, chunks_data: List[dict],
+                     parsed_path: str, pages: int, metadata: dict):
+    """Insert a document's chunk records and mark it DONE in one transaction"""
+    from ..models import Chunk
+    
+    with Session(engine, binds=SESSION_BINDS) as session:
+        document = session.get(Document, document_id)
+        if not document:
+            raise ValueError(f"Document {document_id} not found")
+        
+        document.path_parsed = parsed_path
+        document.pages = pages
+        document.merge_metadata(metadata)
+        
+        # Bulk insert chunk records (skips per-object unit-of-work overhead)
+        session.bulk_insert_mappings(Chunk, [
+            {
+                'bot_id': bot_id,
+                'document_id': document_id,
+                'chunk_id': chunk_data['chunk_id'],
+                'text': chunk_data['text'],
+                'location': json.dumps(chunk_data['location']),
+                'headings': json.dumps(chunk_data['headings'])
+            }
+            for chunk_data in chunks_data
+        ])
+        
+        # Update document status
+        document.status = "DONE"
+        session.commit()
+
+
+def _set_document_status(document_id: int, status: str):
+    """Set a document's status in its own short transaction"""
+    with Session(engine, binds=SESSION_BINDS) as session:
+        document = session.get(Document, document_id)
+        if document:
+            document.status = status
+            session.commit()
+
+
+async def _embed_and_index(embedder, vector_index, collection_name: str, chunks: List[dict]):
+    """Embed chunks in batches, indexing each batch while the next is embedded"""
+    batch_size = settings.embedding_batch_size
+    pending_index = None
+    
+    await asyncio.to_thread(vector_index.begin_bulk, collection_name)
+    try:
+        for start in range(0, len(chunks), batch_size):
+            batch = await asyncio.to_thread(embedder.embed_chunks, chunks[start:start + batch_size])
+            
+            # Keep at most one indexing batch in flight
+            if pending_index:
+                await pending_index
+            pending_index = asyncio.create_task(asyncio.to_thread(
+                vector_index.add_chunks, collection_name, batch
+            ))
+        
+        if pending_index:
+            pending, pending_index = pending_index, None
+            await pending
+    finally:
+        # On failure, let the add already running finish before the bulk ends
+        if pending_index:
+            await asyncio.gather(pending_index, return_exceptions=True)
+        # Write the FAISS index and build Qdrant's once rather than per batch
+        await asyncio.to_thread(vector_index.finish_bulk, collection_name)
+
+
+async def _save_upload(file: UploadFile, file_path: str):
+    """Stream an upload to disk in 1MB chunks, aborting once it exceeds the size cap"""
+    written = 0
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            written += len(chunk)
+            if written > settings.max_file_size:
+                raise _file_too_large(file.filename)
+            await buffer.write(chunk)
+
+
+def _file_too_large(filename: Optional[str]) -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"File {filename} too large (max {settings.max_file_size / 1024 / 1024}MB)"
+    )
+
+
 def _sanitize_filename(filename: str) -> str:
     """Sanitize filename for safe storage"""
-    import re
-    import uuid
-    
     # Remove or replace unsafe characters
-    safe_filename = re.sub(r'[^\w\-_\.]', '_', filename)
+    safe_filename = _UNSAFE_FILENAME_RE.sub('_', filename)
     
     # Ensure unique filename
     name, ext = os.path.splitext(safe_filename)
-    unique_filename = f"{name}_{str(uuid.uuid4())[:8]}{ext}"
+    unique_filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
     
     return unique_filename
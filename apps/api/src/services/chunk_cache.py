@@ -0,0 +1,102 @@
+import hashlib
+import logging
+import os
+import numpy as np
+import orjson
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from ..config import settings
+from .chunking import _ENCODING
+
+logger = logging.getLogger(__name__)
+
+HASH_READ_SIZE = 1 << 20  # 1MB
+
+
+class ChunkCache:
+    """Disk cache of chunked and embedded documents, keyed by content hash.
+
+    Re-uploading a document with the same parsed content reuses its chunks
+    and embeddings instead of chunking and embedding it again.
+    """
+
+    def __init__(self):
+        self.cache_dir = Path(settings.chunk_cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, parsed_path: str, parsed_data: Dict[str, Any]) -> str:
+        """Hash the parsed content together with everything that shapes its chunks.
+
+        The parsed text is streamed from its file rather than encoded in
+        memory, so it is never held twice; hashlib's OpenSSL sha256 uses the
+        CPU's SHA extensions where available.
+        """
+        digest = hashlib.sha256()
+        # Anything that changes chunk boundaries or vectors must change the key
+        digest.update(
+            f"{_ENCODING.name}:{settings.chunk_size}:{settings.chunk_overlap}:"
+            f"{settings.embedding_model}:{settings.embedding_backend}:"
+            f"{settings.embedding_onnx_file}\0".encode()
+        )
+        with open(parsed_path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_READ_SIZE), b''):
+                digest.update(block)
+        for page in parsed_data.get('page_content', []):
+            digest.update(f"\0{page.get('page')}:{page.get('type')}\0".encode())
+            digest.update(page.get('text', '').encode())
+        return digest.hexdigest()
+
+    def get(self, key: str, document_id: int) -> Optional[List[Dict[str, Any]]]:
+        """Get cached chunks (with embeddings) re-keyed for a document, or None"""
+        chunks_path, embeddings_path = self._paths(key)
+        if not (chunks_path.exists() and embeddings_path.exists()):
+            return None
+
+        try:
+            entry = orjson.loads(chunks_path.read_bytes())
+            embeddings = np.load(embeddings_path)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable chunk cache entry {key}: {e}")
+            return None
+
+        # Chunk ids embed the document id they were created for
+        source_id = f"_{entry['document_id']}_"
+        target_id = f"_{document_id}_"
+        chunks = entry['chunks']
+        for chunk, embedding in zip(chunks, embeddings):
+            chunk['chunk_id'] = chunk['chunk_id'].replace(source_id, target_id, 1)
+            chunk['embedding'] = embedding
+        return chunks
+
+    def set(self, key: str, document_id: int, chunks: List[Dict[str, Any]]):
+        """Cache a document's embedded chunks"""
+        if not chunks:
+            return
+
+        chunks_path, embeddings_path = self._paths(key)
+        try:
+            embeddings = np.vstack([chunk['embedding'] for chunk in chunks]).astype(np.float32)
+            entry = {
+                'document_id': document_id,
+                'chunks': [
+                    {k: v for k, v in chunk.items() if k != 'embedding'}
+                    for chunk in chunks
+                ]
+            }
+
+            # Embeddings first: an entry only counts once its chunk file exists
+            with open(embeddings_path, 'wb') as f:
+                np.save(f, embeddings)
+            tmp_path = f"{chunks_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(entry))
+            os.replace(tmp_path, chunks_path)
+        except Exception as e:
+            logger.warning(f"Failed to write chunk cache entry {key}: {e}")
+
+    def _paths(self, key: str):
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.npy"
+
+
+# Global chunk cache instance
+chunk_cache = ChunkCache()
@@ -1,3 +1,4 @@
+import os
 import re
 import tiktoken
 from typing import List, Dict, Any, Optional
@@ -6,12 +7,31 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Loaded once per process and shared by every chunker
+_ENCODING = tiktoken.get_encoding("cl100k_base")
+
+# Threads tiktoken may use for batch encoding
+_ENCODE_THREADS = os.cpu_count() or 1
+
+# Common heading patterns fused into one alternation (one match per line):
+# Markdown headings, ALL CAPS headings, numbered headings, Title Case headings
+_HEADING_RE = re.compile(
+    r'^(?:#{1,6}\s+.+'
+    r'|[A-Z][A-Z\s]{2,}'
+    r'|\d+\.\s+[A-Z][^.]*'
+    r'|[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\s*)$'
+)
+
+# Sentence-ending punctuation runs, where overlap text is cut
+_SENTENCE_END_RE = re.compile(r'[.!?]+')
+
 
 class SemanticChunker:
     def __init__(self):
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.tokenizer = _ENCODING
         self.chunk_size = settings.chunk_size
         self.chunk_overlap = settings.chunk_overlap
+        self.separator_tokens = len(self.tokenizer.encode('\n\n'))
     
     def chunk_text(self, text: str, metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
         """Chunk text semantically with overlap and heading detection"""
@@ -57,72 +77,74 @@ class SemanticChunker:
                                     page_num: Optional[int] = None, 
                                     page_type: str = 'text') -> List[Dict[str, Any]]:
         """Chunk text by semantic boundaries (headings, paragraphs, etc.)"""
-        chunks = []
+        pieces = []
         
         # Split by headings and major sections
         sections = self._split_by_headings(text)
+        section_tokens = self._encode_batch([section['text'] for section in sections])
         
-        for i, section in enumerate(sections):
+        for i, (section, tokens) in enumerate(zip(sections, section_tokens)):
             if not section['text'].strip():
                 continue
             
             # Further split large sections
-            if len(self.tokenizer.encode(section['text'])) > self.chunk_size:
+            if len(tokens) > self.chunk_size:
                 sub_chunks = self._split_large_section(section['text'], section['headings'])
                 for j, sub_chunk in enumerate(sub_chunks):
-                    chunk_data = self._create_chunk_data(
-                        sub_chunk, metadata, page_num, page_type,
-                        section['headings'], f"{i}_{j}"
-                    )
-                    chunks.append(chunk_data)
+                    pieces.append((sub_chunk, section['headings'], f"{i}_{j}"))
             else:
-                chunk_data = self._create_chunk_data(
-                    section['text'], metadata, page_num, page_type,
-                    section['headings'], str(i)
-                )
-                chunks.append(chunk_data)
+                pieces.append((section['text'], section['headings'], str(i)))
+        
+        # Encode all chunk texts in one batch call
+        chunk_tokens = self._encode_batch([piece[0] for piece in pieces])
+        chunks = [
+            self._create_chunk_data(
+                piece_text, metadata, page_num, page_type,
+                headings, section_id, len(tokens)
+            )
+            for (piece_text, headings, section_id), tokens in zip(pieces, chunk_tokens)
+        ]
         
         # Apply overlap between chunks
-        return self._apply_overlap(chunks)
+        return self._apply_overlap(chunks, chunk_tokens)
+    
+    def _encode_batch(self, texts: List[str]) -> List[List[int]]:
+        """Encode many texts in a single multithreaded tiktoken call"""
+        if not texts:
+            return []
+        return self.tokenizer.encode_ordinary_batch(texts, num_threads=_ENCODE_THREADS)
     
     def _split_by_headings(self, text: str) -> List[Dict[str, Any]]:
         """Split text by headings and major sections"""
         sections = []
         
-        # Common heading patterns
-        heading_patterns = [
-            r'^#{1,6}\s+(.+)$',  # Markdown headings
-            r'^[A-Z][A-Z\s]{2,}$',  # ALL CAPS headings
-            r'^\d+\.\s+[A-Z][^.]*$',  # Numbered headings
-            r'^[A-Z][a-z]+(?:\s+[A-Z][a-z]+)*\s*$',  # Title Case headings
-        ]
+        # Sections collect lines and are joined once, avoiding repeated
+        # string concatenation on long sections
+        current_lines: List[str] = []
+        current_headings: List[str] = []
         
-        lines = text.split('\n')
-        current_section = {'text': '', 'headings': []}
+        def flush():
+            section_text = '\n'.join(current_lines) + '\n'
+            if section_text.strip():
+                sections.append({'text': section_text, 'headings': current_headings})
         
-        for line in lines:
-            is_heading = False
-            
-            for pattern in heading_patterns:
-                if re.match(pattern, line.strip()):
-                    # Save current section if it has content
-                    if current_section['text'].strip():
-                        sections.append(current_section)
-                    
-                    # Start new section
-                    current_section = {
-                        'text': line + '\n',
-                        'headings': [line.strip()]
-                    }
-                    is_heading = True
-                    break
+        for line in text.splitlines():
+            stripped = line.strip()
             
-            if not is_heading:
-                current_section['text'] += line + '\n'
+            if _HEADING_RE.match(stripped):
+                # Save current section if it has content
+                if current_lines:
+                    flush()
+                
+                # Start new section
+                current_lines = [line]
+                current_headings = [stripped]
+            else:
+                current_lines.append(line)
         
         # Add the last section
-        if current_section['text'].strip():
-            sections.append(current_section)
+        if current_lines:
+            flush()
         
         return sections
     
@@ -131,22 +153,26 @@ class SemanticChunker:
         chunks = []
         
         # Split by paragraphs first
-        paragraphs = text.split('\n\n')
+        paragraphs = [p for p in text.split('\n\n') if p.strip()]
+        paragraph_counts = [len(tokens) for tokens in self._encode_batch(paragraphs)]
         current_chunk = ''
+        current_tokens = 0
         
-        for paragraph in paragraphs:
-            if not paragraph.strip():
-                continue
-            
+        # Encode each paragraph once and keep a running token count
+        for paragraph, paragraph_tokens in zip(paragraphs, paragraph_counts):
             # Check if adding this paragraph would exceed chunk size
-            test_chunk = current_chunk + '\n\n' + paragraph if current_chunk else paragraph
-            token_count = len(self.tokenizer.encode(test_chunk))
+            if current_chunk:
+                token_count = current_tokens + self.separator_tokens + paragraph_tokens
+            else:
+                token_count = paragraph_tokens
             
             if token_count > self.chunk_size and current_chunk:
                 chunks.append(current_chunk.strip())
                 current_chunk = paragraph
+                current_tokens = paragraph_tokens
             else:
-                current_chunk = test_chunk
+                current_chunk = current_chunk + '\n\n' + paragraph if current_chunk else paragraph
+                current_tokens = token_count
         
         # Add the last chunk
         if current_chunk.strip():
@@ -156,7 +182,8 @@ class SemanticChunker:
     
     def _create_chunk_data(self, text: str, metadata: Dict[str, Any], 
                           page_num: Optional[int], page_type: str,
-                          headings: List[str], section_id: str) -> Dict[str, Any]:
+                          headings: List[str], section_id: str,
+                          token_count: int) -> Dict[str, Any]:
         """Create chunk data with metadata"""
         chunk_id = f"chunk_{metadata.get('document_id', 'unknown')}_{page_num or 1}_{section_id}"
         
@@ -171,34 +198,31 @@ class SemanticChunker:
             'text': text,
             'location': location,
             'headings': headings,
-            'token_count': len(self.tokenizer.encode(text))
+            'token_count': token_count
         }
     
-    def _apply_overlap(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _apply_overlap(self, chunks: List[Dict[str, Any]],
+                       chunk_tokens: List[List[int]]) -> List[Dict[str, Any]]:
         """Apply overlap between chunks"""
         if len(chunks) <= 1:
             return chunks
         
-        overlapped_chunks = []
+        # Overlap comes from each previous chunk's own text (tokens already encoded)
+        overlap_texts = [
+            self._get_overlap_text(chunk['text'], tokens, self.chunk_overlap)
+            for chunk, tokens in zip(chunks[:-1], chunk_tokens[:-1])
+        ]
+        overlap_tokens = self._encode_batch(overlap_texts)
         
-        for i, chunk in enumerate(chunks):
-            if i > 0:
-                # Add overlap from previous chunk
-                prev_chunk = chunks[i-1]
-                overlap_text = self._get_overlap_text(prev_chunk['text'], self.chunk_overlap)
-                
-                if overlap_text:
-                    chunk['text'] = overlap_text + '\n\n' + chunk['text']
-                    chunk['token_count'] = len(self.tokenizer.encode(chunk['text']))
-            
-            overlapped_chunks.append(chunk)
+        for chunk, overlap_text, tokens in zip(chunks[1:], overlap_texts, overlap_tokens):
+            if overlap_text:
+                chunk['text'] = overlap_text + '\n\n' + chunk['text']
+                chunk['token_count'] += len(tokens) + self.separator_tokens
         
-        return overlapped_chunks
+        return chunks
     
-    def _get_overlap_text(self, text: str, overlap_tokens: int) -> str:
+    def _get_overlap_text(self, text: str, tokens: List[int], overlap_tokens: int) -> str:
         """Get the last N tokens as overlap text"""
-        tokens = self.tokenizer.encode(text)
-        
         if len(tokens) <= overlap_tokens:
             return text
         
@@ -207,7 +231,7 @@ class SemanticChunker:
         overlap_text = self.tokenizer.decode(overlap_tokens_list)
         
         # Try to break at a sentence boundary
-        sentences = re.split(r'[.!?]+', overlap_text)
+        sentences = _SENTENCE_END_RE.split(overlap_text)
         if len(sentences) > 1:
             # Return everything except the last incomplete sentence
             return '. '.join(sentences[:-1]) + '.'
@@ -234,3 +258,7 @@ class SemanticChunker:
             chunks.append(chunk_data)
         
         return chunks
+
+
+# Global chunker instance (stateless, safe to share across tasks)
+semantic_chunker = SemanticChunker()
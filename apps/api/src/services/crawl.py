@@ -1,24 +1,157 @@
 import asyncio
+import hashlib
+import io
 import logging
-from typing import List, Dict, Any, Set, Optional
-from urllib.parse import urljoin, urlparse
-import re
-import requests
+import time
+from collections import deque
+from typing import List, Dict, Any, Set, Optional, AsyncIterator
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlunparse
+import aiohttp
+import diskcache
+import numpy as np
 import trafilatura
+from selectolax.parser import HTMLParser
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Anchors, javascript, mailto, etc. (str.startswith/endswith take tuples)
+_INVALID_SCHEMES = ('javascript:', 'mailto:', 'tel:', '#')
+
+# File extensions that are not web pages
+_INVALID_EXTENSIONS = ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+                       '.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico', '.css', '.js')
+
+
+# Query parameters that don't change page content
+_TRACKING_PARAMS = frozenset({'gclid', 'fbclid', 'msclkid', 'mc_cid', 'mc_eid'})
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+FETCH_CHUNK_SIZE = 64 * 1024  # 64KB
+
+# Resources a rendered page doesn't need for text extraction
+_BLOCKED_RESOURCE_TYPES = frozenset({'image', 'stylesheet', 'font', 'media'})
+
+# Pages whose SimHashes differ in at most this many of 64 bits are near-duplicates
+SIMHASH_MAX_DISTANCE = 3
+SIMHASH_SHINGLE_SIZE = 3  # Words per shingle
+
+
+def _canonicalize_url(url: str) -> str:
+    """Collapse equivalent URL variants into one key for visited-URL dedup.
+
+    Lowercases scheme and host, drops default ports, fragments, tracking
+    parameters and trailing slashes, and sorts the query string.
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and parsed.port != _DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parsed.port}"
+    
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in _TRACKING_PARAMS
+    )
+    path = parsed.path.rstrip('/') or '/'
+    
+    return urlunparse((scheme, host, path, '', urlencode(query), ''))
+
+
+def _simhash(text: str) -> int:
+    """64-bit SimHash of a text over its word shingles.
+
+    Each bit is the majority vote of that bit across the shingles' hashes,
+    so texts that share most shingles land a few bits apart.
+    """
+    words = text.lower().split()
+    shingles = [
+        ' '.join(words[i:i + SIMHASH_SHINGLE_SIZE])
+        for i in range(max(len(words) - SIMHASH_SHINGLE_SIZE + 1, 1))
+    ]
+    digests = b''.join(hashlib.blake2b(s.encode(), digest_size=8).digest() for s in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    votes = bits.sum(axis=0) * 2 > len(shingles)
+    return int.from_bytes(np.packbits(votes).tobytes(), 'big')
+
+
+async def _block_heavy_resources(route):
+    """Playwright route handler that aborts image, stylesheet, font and media requests"""
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def _is_near_duplicate(fingerprint: int, seen: List[int]) -> bool:
+    """Whether a SimHash is within SIMHASH_MAX_DISTANCE bits of one already seen"""
+    return any(bin(fingerprint ^ other).count('1') <= SIMHASH_MAX_DISTANCE for other in seen)
+
 
 class WebCrawler:
     def __init__(self):
         self.max_depth = settings.max_crawl_depth
         self.max_urls = settings.max_urls_per_crawl
         self.timeout = settings.crawl_timeout
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-        })
+        }
+        
+        # Long-lived across crawls (pooled connections, one running browser);
+        # created on first use and released by close()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._playwright = None
+        self._browser = None
+        self._browser_lock = asyncio.Lock()
+        
+        # Fetched HTML by canonical URL, shared across crawls and processes
+        self._cache = None
+        if settings.enable_crawl_cache:
+            self._cache = diskcache.Cache(
+                settings.crawl_cache_dir,
+                size_limit=settings.crawl_cache_size_limit,
+                eviction_policy='least-recently-used'
+            )
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Get the shared aiohttp session, creating it inside the running loop"""
+        if self._session is None or self._session.closed:
+            # DNS answers are kept for 5 minutes (default 10s) across crawls
+            connector = aiohttp.TCPConnector(
+                limit=settings.crawl_concurrency, limit_per_host=8, keepalive_timeout=30,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+    
+    async def _get_browser(self):
+        """Get the shared headless Chromium, launching it once (raises ImportError without Playwright)"""
+        async with self._browser_lock:
+            if self._browser is None:
+                from playwright.async_api import async_playwright
+                
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch(headless=True)
+        return self._browser
+    
+    async def close(self):
+        """Close the shared session and browser"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        if self._cache is not None:
+            self._cache.close()
     
     async def crawl_url(self, root_url: str, depth: int = None, render_js: bool = False) -> Dict[str, Any]:
         """Crawl a URL and extract content"""
@@ -29,145 +162,251 @@ class WebCrawler:
             if render_js and settings.enable_playwright:
                 return await self._crawl_with_playwright(root_url, depth)
             else:
-                return await self._crawl_with_requests(root_url, depth)
+                return await self._crawl_with_aiohttp(root_url, depth)
                 
         except Exception as e:
             logger.error(f"Error crawling {root_url}: {e}")
             raise
     
-    async def _crawl_with_requests(self, root_url: str, depth: int) -> Dict[str, Any]:
-        """Crawl using requests + trafilatura (lightweight)"""
-        crawled_urls = []
-        visited_urls = set()
-        
-        await self._crawl_recursive_requests(root_url, depth, 0, crawled_urls, visited_urls)
+    async def _crawl_with_aiohttp(self, root_url: str, depth: int) -> Dict[str, Any]:
+        """Crawl using aiohttp + trafilatura (lightweight), one depth level at a time"""
+        crawled_urls = [page async for page in self.iter_pages(root_url, depth)]
         
         return {
             'root_url': root_url,
             'crawled_urls': crawled_urls,
             'total_urls': len(crawled_urls),
-            'method': 'requests+trafilatura'
+            'method': 'aiohttp+trafilatura'
         }
     
-    async def _crawl_with_playwright(self, root_url: str, depth: int) -> Dict[str, Any]:
-        """Crawl using Playwright (optional, heavy)"""
-        try:
-            from playwright.async_api import async_playwright
+    async def iter_pages(self, root_url: str, depth: int = None) -> AsyncIterator[Dict[str, Any]]:
+        """Crawl with aiohttp, yielding each kept page as soon as its level is fetched.
+
+        Consumers can process a level's pages while the crawl fetches the
+        next one; pages arrive in the same order crawl_url returns them.
+        """
+        if depth is None:
+            depth = self.max_depth
+        
+        crawled_count = 0
+        visited_urls = {_canonicalize_url(root_url)}
+        fingerprints: List[int] = []
+        
+        semaphore = asyncio.BoundedSemaphore(settings.crawl_concurrency)
+        session = self._get_session()
+        level = [root_url]
+        
+        for current_depth in range(depth + 1):
+            if not level or crawled_count >= self.max_urls:
+                break
             
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(headless=True)
-                page = await browser.new_page()
-                
-                crawled_urls = []
-                visited_urls = set()
-                
-                await self._crawl_recursive_playwright(page, root_url, depth, 0, crawled_urls, visited_urls)
-                
-                await browser.close()
+            # Don't fetch more pages than the crawl can still keep
+            level = level[:self.max_urls - crawled_count]
+            
+            # Fetch the whole level concurrently
+            pages = await asyncio.gather(*[
+                self._fetch_page(session, semaphore, url) for url in level
+            ])
+            
+            # Results are handled in link order on the event loop thread,
+            # so visited/crawled bookkeeping needs no lock
+            next_level = []
+            for url, html in zip(level, pages):
+                if html is None:
+                    continue
+                if crawled_count >= self.max_urls:
+                    break
                 
-                return {
-                    'root_url': root_url,
-                    'crawled_urls': crawled_urls,
-                    'total_urls': len(crawled_urls),
-                    'method': 'playwright'
-                }
+                page = self._extract_page(url, html, current_depth)
+                if page and self._is_new_content(page['text'], fingerprints):
+                    crawled_count += 1
+                    yield page
                 
-        except ImportError:
-            logger.warning("Playwright not available, falling back to requests")
-            return await self._crawl_with_requests(root_url, depth)
+                # Find links for next level
+                if current_depth < depth:
+                    for link in self._extract_links_from_html(html, url)[:5]:  # Limit links per page
+                        key = _canonicalize_url(link)
+                        if key not in visited_urls:
+                            visited_urls.add(key)
+                            next_level.append(link)
+            
+            level = next_level
     
-    async def _crawl_recursive_requests(self, url: str, max_depth: int, current_depth: int,
-                                      crawled_urls: List[Dict[str, Any]], visited_urls: Set[str]):
-        """Recursively crawl URLs using requests"""
-        if current_depth > max_depth or len(crawled_urls) >= self.max_urls:
-            return
+    async def _fetch_page(self, session: aiohttp.ClientSession, semaphore: asyncio.BoundedSemaphore,
+                          url: str) -> Optional[str]:
+        """Fetch a page's HTML (at most crawl_max_page_bytes of it), or None if it fails"""
+        key = _canonicalize_url(url)
+        # diskcache does blocking SQLite and file I/O, so it runs off the event loop
+        cached = await asyncio.to_thread(self._cache.get, key) if self._cache is not None else None
         
-        if url in visited_urls:
-            return
+        # Fresh copies skip the network entirely
+        if cached and time.time() - cached['fetched_at'] < settings.crawl_cache_ttl:
+            return cached['html']
         
-        visited_urls.add(url)
+        # Stale copies are revalidated, so an unchanged page costs only a 304
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
         
         try:
-            # Fetch the page
-            response = self.session.get(url, timeout=self.timeout)
-            response.raise_for_status()
-            
-            # Extract content using trafilatura
-            extracted = trafilatura.extract(response.text, include_formatting=True)
-            
-            if extracted and extracted.strip():
-                # Get title
-                title = trafilatura.extract_metadata(response.text).get('title', 'Untitled')
-                
-                crawled_urls.append({
-                    'url': url,
-                    'title': title,
-                    'text': extracted,
-                    'depth': current_depth
-                })
-            
-            # Find links for next level
-            if current_depth < max_depth and len(crawled_urls) < self.max_urls:
-                links = self._extract_links_from_html(response.text, url)
-                
-                for link in links[:5]:  # Limit links per page
-                    if len(crawled_urls) >= self.max_urls:
-                        break
-                    await self._crawl_recursive_requests(link, max_depth, current_depth + 1,
-                                                       crawled_urls, visited_urls)
+            async with semaphore:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        await asyncio.to_thread(
+                            self._cache_page, key, cached['html'], cached.get('etag'), cached.get('last_modified')
+                        )
+                        return cached['html']
+                    
+                    response.raise_for_status()
                     
+                    # Redirects and extensionless URLs can still serve non-HTML
+                    if not response.content_type.startswith('text/html'):
+                        logger.info(f"Skipping {url}: {response.content_type}")
+                        return None
+                    
+                    # Stream the body and stop at the cap instead of buffering it all
+                    data = bytearray()
+                    async for chunk in response.content.iter_chunked(FETCH_CHUNK_SIZE):
+                        data.extend(chunk)
+                        if len(data) >= settings.crawl_max_page_bytes:
+                            logger.info(f"Truncated {url} at {settings.crawl_max_page_bytes} bytes")
+                            del data[settings.crawl_max_page_bytes:]
+                            break
+                    
+                    html = data.decode(response.get_encoding(), errors='replace')
+                    await asyncio.to_thread(
+                        self._cache_page,
+                        key, html, response.headers.get('ETag'), response.headers.get('Last-Modified')
+                    )
+                    return html
         except Exception as e:
             logger.warning(f"Error crawling {url}: {e}")
+            return None
     
-    async def _crawl_recursive_playwright(self, page, url: str, max_depth: int, current_depth: int,
-                                        crawled_urls: List[Dict[str, Any]], visited_urls: Set[str]):
-        """Recursively crawl URLs using Playwright"""
-        if current_depth > max_depth or len(crawled_urls) >= self.max_urls:
+    def _cache_page(self, key: str, html: str, etag: Optional[str], last_modified: Optional[str]):
+        """Store a fetched page with its validators"""
+        if self._cache is None:
             return
+        try:
+            self._cache.set(key, {
+                'html': html,
+                'etag': etag,
+                'last_modified': last_modified,
+                'fetched_at': time.time()
+            })
+        except Exception as e:
+            logger.warning(f"Failed to cache {key}: {e}")
+    
+    def _extract_page(self, url: str, html: str, depth: int) -> Optional[Dict[str, Any]]:
+        """Extract a page's main content using trafilatura"""
+        # Parse once; metadata is read before extract() prunes its copy of the tree
+        tree = trafilatura.load_html(html)
+        if tree is None:
+            return None
+        metadata = trafilatura.extract_metadata(tree)
         
-        if url in visited_urls:
-            return
+        # fast skips the fallback extractors; comments aren't page content
+        extracted = trafilatura.extract(tree, include_formatting=True, include_comments=False, fast=True)
         
-        visited_urls.add(url)
+        if not extracted or not extracted.strip():
+            return None
         
+        # Get title
+        title = (metadata.title if metadata else None) or 'Untitled'
+        
+        return {
+            'url': url,
+            'title': title,
+            'text': extracted,
+            'depth': depth
+        }
+    
+    async def _crawl_with_playwright(self, root_url: str, depth: int) -> Dict[str, Any]:
+        """Crawl using Playwright (optional, heavy)"""
         try:
-            # Navigate to the page
-            await page.goto(url, wait_until='networkidle', timeout=self.timeout * 1000)
-            
-            # Extract content
-            title = await page.title()
-            content = await page.content()
-            
-            # Use trafilatura for content extraction
-            extracted = trafilatura.extract(content, include_formatting=True)
-            
-            if extracted and extracted.strip():
-                crawled_urls.append({
-                    'url': url,
-                    'title': title,
-                    'text': extracted,
-                    'depth': current_depth
-                })
+            browser = await self._get_browser()
+        except ImportError:
+            logger.warning("Playwright not available, falling back to aiohttp")
+            return await self._crawl_with_aiohttp(root_url, depth)
+        
+        # A fresh context per crawl is cheap and isolates cookies and storage
+        context = await browser.new_context()
+        await context.route("**/*", _block_heavy_resources)
+        try:
+            page = await context.new_page()
+            crawled_urls = await self._crawl_bfs_playwright(page, root_url, depth)
+        finally:
+            await context.close()
+        
+        return {
+            'root_url': root_url,
+            'crawled_urls': crawled_urls,
+            'total_urls': len(crawled_urls),
+            'method': 'playwright'
+        }
+    
+    async def _crawl_bfs_playwright(self, page, root_url: str, max_depth: int) -> List[Dict[str, Any]]:
+        """Crawl URLs breadth-first using Playwright, with an explicit queue instead of recursion"""
+        crawled_urls = []
+        visited_urls: Set[str] = {_canonicalize_url(root_url)}
+        fingerprints: List[int] = []
+        frontier = deque([(root_url, 0)])
+        
+        while frontier and len(crawled_urls) < self.max_urls:
+            url, current_depth = frontier.popleft()
             
-            # Find links for next level
-            if current_depth < max_depth and len(crawled_urls) < self.max_urls:
-                links = await self._extract_links_playwright(page, url)
+            try:
+                # Navigate to the page; with heavy resources blocked, network idle
+                # only waits on documents, scripts and the XHRs that render content
+                await page.goto(url, wait_until='networkidle', timeout=self.timeout * 1000)
                 
-                for link in links[:5]:  # Limit links per page
-                    if len(crawled_urls) >= self.max_urls:
-                        break
-                    await self._crawl_recursive_playwright(page, link, max_depth, current_depth + 1,
-                                                         crawled_urls, visited_urls)
+                # Extract content
+                title = await page.title()
+                content = await page.content()
+                
+                # Use trafilatura for content extraction
+                extracted = trafilatura.extract(content, include_formatting=True, include_comments=False, fast=True)
+                
+                if extracted and extracted.strip() and self._is_new_content(extracted, fingerprints):
+                    crawled_urls.append({
+                        'url': url,
+                        'title': title,
+                        'text': extracted,
+                        'depth': current_depth
+                    })
+                
+                # Queue links for the next level
+                if current_depth < max_depth:
+                    links = await self._extract_links_playwright(page, url)
                     
-        except Exception as e:
-            logger.warning(f"Error crawling {url}: {e}")
+                    for link in links[:5]:  # Limit links per page
+                        key = _canonicalize_url(link)
+                        if key not in visited_urls:
+                            visited_urls.add(key)
+                            frontier.append((link, current_depth + 1))
+                        
+            except Exception as e:
+                logger.warning(f"Error crawling {url}: {e}")
+        
+        return crawled_urls
+    
+    def _is_new_content(self, text: str, fingerprints: List[int]) -> bool:
+        """Record a page's SimHash, or reject it as a near-duplicate of a crawled page
+        (pagination, print views and the like), so it is never embedded"""
+        fingerprint = _simhash(text)
+        if _is_near_duplicate(fingerprint, fingerprints):
+            return False
+        fingerprints.append(fingerprint)
+        return True
     
     def _extract_links_from_html(self, html: str, base_url: str) -> List[str]:
-        """Extract links from HTML using regex (lightweight)"""
+        """Extract links from <a href> tags using selectolax's C parser"""
         try:
-            # Simple regex to find href attributes
-            href_pattern = r'href=["\']([^"\']+)["\']'
-            matches = re.findall(href_pattern, html, re.IGNORECASE)
+            # Only anchor hrefs (no <link>/<script> noise); entities are decoded
+            tree = HTMLParser(html)
+            matches = [node.attributes.get('href') for node in tree.css('a[href]')]
             
             valid_links = []
             base_domain = urlparse(base_url).netloc
@@ -176,14 +415,11 @@ class WebCrawler:
                 if not link:
                     continue
                 
-                # Parse the link
-                parsed = urlparse(link)
+                # Normalize the URL (resolves relative links against the page)
+                normalized = urljoin(base_url, link)
                 
                 # Only follow links from the same domain
-                if parsed.netloc == base_domain:
-                    # Normalize the URL
-                    normalized = urljoin(base_url, link)
-                    
+                if urlparse(normalized).netloc == base_domain:
                     # Skip anchors, javascript, etc.
                     if self._is_valid_url(normalized):
                         valid_links.append(normalized)
@@ -225,42 +461,29 @@ class WebCrawler:
         if not url:
             return False
         
-        # Skip anchors, javascript, mailto, etc.
-        invalid_schemes = ['javascript:', 'mailto:', 'tel:', '#']
-        for scheme in invalid_schemes:
-            if url.startswith(scheme):
-                return False
-        
-        # Skip file extensions that are not web pages
-        invalid_extensions = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', 
-                            '.jpg', '.jpeg', '.png', '.gif', '.svg', '.ico', '.css', '.js']
-        for ext in invalid_extensions:
-            if url.lower().endswith(ext):
-                return False
+        if url.startswith(_INVALID_SCHEMES):
+            return False
         
-        return True
+        return not url.lower().endswith(_INVALID_EXTENSIONS)
     
     def process_crawled_content(self, crawled_data: Dict[str, Any]) -> str:
         """Process crawled content into a single text document"""
         try:
-            content_parts = []
+            # Each page is written straight into one buffer as a single section
+            buffer = io.StringIO()
             
             for url_data in crawled_data['crawled_urls']:
-                title = url_data['title']
-                text = url_data['text']
-                url = url_data['url']
-                
-                # Add URL and title as section header
-                content_parts.append(f"# {title}")
-                content_parts.append(f"Source: {url}")
-                content_parts.append("")
-                content_parts.append(text)
-                content_parts.append("")
-                content_parts.append("---")
-                content_parts.append("")
+                buffer.write(self.format_page(url_data))
             
-            return '\n'.join(content_parts)
+            return buffer.getvalue()
             
         except Exception as e:
             logger.error(f"Error processing crawled content: {e}")
             return ""
+    
+    def format_page(self, url_data: Dict[str, Any]) -> str:
+        """Format one crawled page as a document section (URL and title as header)"""
+        return (
+            f"# {url_data['title']}\nSource: {url_data['url']}\n\n"
+            f"{url_data['text']}\n\n---\n\n"
+        )
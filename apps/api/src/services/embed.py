@@ -1,5 +1,5 @@
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from sentence_transformers import SentenceTransformer
 import logging
 from ..config import settings
@@ -17,32 +17,61 @@ class EmbeddingService:
         """Load the embedding model"""
         try:
             logger.info(f"Loading embedding model: {self.model_name}")
-            self.model = SentenceTransformer(self.model_name)
+            if settings.embedding_backend == "onnx":
+                self.model = self._load_onnx_model()
+            if self.model is None:
+                self.model = SentenceTransformer(self.model_name)
             logger.info("Embedding model loaded successfully")
         except Exception as e:
             logger.error(f"Error loading embedding model: {e}")
             raise
     
-    def embed_text(self, text: str) -> List[float]:
-        """Embed a single text string"""
+    def _load_onnx_model(self) -> Optional[SentenceTransformer]:
+        """Load the model on ONNX Runtime (int8/fp16 weights via embedding_onnx_file),
+        or None to fall back to PyTorch"""
+        model_kwargs = {"provider": "CPUExecutionProvider"}
+        if settings.embedding_onnx_file:
+            model_kwargs["file_name"] = settings.embedding_onnx_file
+        
+        try:
+            # encode() is unchanged: same tokenization, pooling and normalization
+            return SentenceTransformer(self.model_name, backend="onnx", model_kwargs=model_kwargs)
+        except Exception as e:
+            logger.warning(f"ONNX embedding backend unavailable, using PyTorch: {e}")
+            return None
+    
+    def embed_text(self, text: str) -> np.ndarray:
+        """Embed a single text string into a float32 unit vector"""
         try:
             if not self.model:
                 raise ValueError("Embedding model not loaded")
             
-            embedding = self.model.encode(text, convert_to_tensor=False)
-            return embedding.tolist()
+            embedding = self.model.encode(text, convert_to_numpy=True, normalize_embeddings=True)
+            return embedding.astype(np.float32, copy=False)
         except Exception as e:
             logger.error(f"Error embedding text: {e}")
             raise
     
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
         """Embed multiple text strings"""
+        return self.embed_texts_array(texts).tolist()
+    
+    def embed_texts_array(self, texts: List[str]) -> np.ndarray:
+        """Embed multiple text strings into a single (N, dim) float32 array of unit vectors"""
         try:
             if not self.model:
                 raise ValueError("Embedding model not loaded")
             
-            embeddings = self.model.encode(texts, convert_to_tensor=False)
-            return embeddings.tolist()
+            # encode() batches texts in length-sorted order (minimizing padding)
+            # and restores the input order itself
+            embeddings = self.model.encode(
+                texts,
+                batch_size=settings.embedding_batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
+            return embeddings.astype(np.float32, copy=False)
         except Exception as e:
             logger.error(f"Error embedding texts: {e}")
             raise
@@ -50,10 +79,11 @@ class EmbeddingService:
     def embed_chunks(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Embed a list of chunks and return chunks with embeddings"""
         try:
+            # One encode call over a contiguous list of texts
             texts = [chunk['text'] for chunk in chunks]
-            embeddings = self.embed_texts(texts)
+            embeddings = self.embed_texts_array(texts)
             
-            # Add embeddings to chunks
+            # Each chunk gets a float32 row view of the shared array
             for chunk, embedding in zip(chunks, embeddings):
                 chunk['embedding'] = embedding
             
@@ -62,15 +92,26 @@ class EmbeddingService:
             logger.error(f"Error embedding chunks: {e}")
             raise
     
+    def iter_embed(self, chunks: List[Dict[str, Any]],
+                   batch_size: Optional[int] = None) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+        """Embed chunks lazily, yielding (vectors, batch) pairs of one batch each.
+
+        Chunks are left untouched; only one batch of vectors exists at a time
+        unless the consumer keeps them.
+        """
+        batch_size = batch_size or settings.embedding_batch_size
+        for start in range(0, len(chunks), batch_size):
+            batch = chunks[start:start + batch_size]
+            yield self.embed_texts_array([chunk['text'] for chunk in batch]), batch
+    
     def get_embedding_dimension(self) -> int:
         """Get the dimension of the embedding vectors"""
         try:
             if not self.model:
                 raise ValueError("Embedding model not loaded")
             
-            # Create a dummy embedding to get the dimension
-            dummy_embedding = self.model.encode("test", convert_to_tensor=False)
-            return dummy_embedding.shape[0]
+            # Read from the model config rather than running a dummy encode
+            return self.model.get_sentence_embedding_dimension()
         except Exception as e:
             logger.error(f"Error getting embedding dimension: {e}")
             raise
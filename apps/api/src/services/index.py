@@ -1,5 +1,7 @@
 import logging
-from typing import List, Dict, Any, Optional, Tuple
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
 import numpy as np
 from ..config import settings
 from .index_faiss import vector_index_manager
@@ -9,18 +11,34 @@ logger = logging.getLogger(__name__)
 # Try to import Qdrant (optional)
 try:
     from qdrant_client import QdrantClient
-    from qdrant_client.models import Distance, VectorParams, PointStruct, Filter, FieldCondition, MatchValue
+    from qdrant_client.models import Distance, VectorParams, Filter, FieldCondition, MatchAny
+    from qdrant_client.models import ScalarQuantization, ScalarQuantizationConfig, ScalarType
+    from qdrant_client.models import OptimizersConfigDiff, Datatype
     QDRANT_AVAILABLE = True
 except ImportError:
     QDRANT_AVAILABLE = False
     logger.info("Qdrant not available, using FAISS only")
 
+# Qdrant's default indexing threshold (KB of vectors before a segment gets HNSW),
+# restored once a bulk load finishes
+QDRANT_INDEXING_THRESHOLD = 20000
+
+# Threads for Qdrant queries issued alongside the FAISS search
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="qdrant-search")
+
+
+def _point_id(chunk_id: str) -> str:
+    """Stable Qdrant point id for a chunk (Qdrant ids must be integers or UUIDs)"""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, chunk_id))
+
 
 class VectorIndex:
     def __init__(self):
         self.qdrant_client = None
         self.use_qdrant = False
         self.embedding_dim = None
+        # Collections known to exist, so repeat ingests skip the setup round-trips
+        self._known_collections: Set[str] = set()
         self._initialize()
     
     def _initialize(self):
@@ -33,7 +51,9 @@ class VectorIndex:
             try:
                 self.qdrant_client = QdrantClient(
                     url=settings.qdrant_url,
-                    api_key=settings.qdrant_api_key
+                    api_key=settings.qdrant_api_key,
+                    prefer_grpc=settings.qdrant_prefer_grpc,
+                    grpc_port=settings.qdrant_grpc_port
                 )
                 # Test connection
                 self.qdrant_client.get_collections()
@@ -46,8 +66,10 @@ class VectorIndex:
             logger.info("Qdrant not configured, using FAISS only")
     
     def create_collection(self, collection_name: str, embedding_dim: int):
-        """Create a collection (FAISS always, Qdrant optional)"""
+        """Create a collection unless it exists (FAISS always, Qdrant optional)"""
         self.embedding_dim = embedding_dim
+        if collection_name in self._known_collections:
+            return
         
         # Always create FAISS collection
         vector_index_manager.get_collection(collection_name)
@@ -55,104 +77,200 @@ class VectorIndex:
         # Optionally create Qdrant collection
         if self.use_qdrant:
             try:
-                self.qdrant_client.recreate_collection(
-                    collection_name=collection_name,
-                    vectors_config=VectorParams(
-                        size=embedding_dim,
-                        distance=Distance.COSINE
-                    )
-                )
-                logger.info(f"Created Qdrant collection: {collection_name}")
+                if not self.qdrant_client.collection_exists(collection_name):
+                    self._create_qdrant_collection(collection_name, embedding_dim)
             except Exception as e:
+                # Not remembered, so the next ingest tries again
                 logger.warning(f"Failed to create Qdrant collection: {e}")
+                return
+        
+        self._known_collections.add(collection_name)
+    
+    def _create_qdrant_collection(self, collection_name: str, embedding_dim: int):
+        """Create an empty Qdrant collection"""
+        # Storage precision follows the FAISS setting: int8 keeps an
+        # int8-quantized copy in RAM for search, f16 stores vectors as
+        # float16 (half the memory and disk of float32)
+        quantization_config = None
+        datatype = None
+        if settings.embedding_storage == "int8":
+            quantization_config = ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, always_ram=True)
+            )
+        elif settings.embedding_storage == "f16":
+            datatype = Datatype.FLOAT16
+        
+        self.qdrant_client.create_collection(
+            collection_name=collection_name,
+            vectors_config=VectorParams(
+                size=embedding_dim,
+                # Vectors are unit length already, so dot product equals
+                # cosine without Qdrant normalizing each one again
+                distance=Distance.DOT,
+                datatype=datatype
+            ),
+            quantization_config=quantization_config
+        )
+        logger.info(f"Created Qdrant collection: {collection_name}")
     
     def add_chunks(self, collection_name: str, chunks: List[Dict[str, Any]]):
-        """Add chunks to the vector database"""
+        """Add embedded chunks (each with an 'embedding') to the vector database"""
+        if not chunks:
+            return
+        vectors = np.vstack([chunk['embedding'] for chunk in chunks])
+        self.add_vectors(collection_name, vectors, chunks)
+    
+    def add_vectors(self, collection_name: str, vectors: np.ndarray, chunks: List[Dict[str, Any]]):
+        """Add chunks with their vectors as one (N, dim) matrix, row i belonging to chunks[i].
+        
+        The matrix goes to FAISS and Qdrant as is, without per-chunk vectors.
+        FAISS is written by the next flush or save_collection.
+        """
+        if not chunks:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        
         # Always add to FAISS
         faiss_collection = vector_index_manager.get_collection(collection_name)
-        faiss_collection.add_chunks(chunks)
+        faiss_collection.add_chunks(chunks, vectors)
         
         # Optionally add to Qdrant
         if self.use_qdrant:
             try:
-                points = []
-                for chunk in chunks:
-                    point = PointStruct(
-                        id=chunk['chunk_id'],
-                        vector=chunk['embedding'],
-                        payload={
+                # One float32 matrix, uploaded in batches by the client
+                self.qdrant_client.upload_collection(
+                    collection_name=collection_name,
+                    vectors=vectors,
+                    payload=[
+                        {
+                            'chunk_id': chunk['chunk_id'],
                             'text': chunk['text'],
                             'document_id': chunk.get('document_id'),
                             'location': chunk['location'],
                             'headings': chunk['headings']
                         }
-                    )
-                    points.append(point)
-                
-                self.qdrant_client.upsert(
-                    collection_name=collection_name,
-                    points=points
+                        for chunk in chunks
+                    ],
+                    ids=[_point_id(chunk['chunk_id']) for chunk in chunks],
+                    batch_size=settings.qdrant_upload_batch_size
                 )
                 logger.info(f"Added {len(chunks)} chunks to Qdrant collection: {collection_name}")
             except Exception as e:
                 logger.warning(f"Failed to add chunks to Qdrant: {e}")
     
-    def search(self, collection_name: str, query_embedding: List[float], 
-               top_k: int = 8, filter_document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
-        """Search for similar chunks (FAISS primary, Qdrant fallback)"""
-        # Always search FAISS first
-        faiss_collection = vector_index_manager.get_collection(collection_name)
-        faiss_results = faiss_collection.search(query_embedding, top_k, filter_document_ids)
+    def add_batches(self, collection_name: str,
+                    batches: Iterable[Tuple[np.ndarray, List[Dict[str, Any]]]]) -> int:
+        """Add (vectors, chunks) batches as they arrive, e.g. from EmbeddingService.iter_embed.
         
-        # If we have enough results from FAISS, return them
-        if len(faiss_results) >= top_k:
-            return faiss_results
+        Each batch is indexed before the next is pulled, so only one batch of
+        vectors is held at a time. Returns the number of chunks added.
+        """
+        added = 0
+        for vectors, chunks in batches:
+            self.add_vectors(collection_name, vectors, chunks)
+            added += len(chunks)
+        return added
+    
+    def begin_bulk(self, collection_name: str):
+        """Prepare a collection for a large load of add_chunks calls.
+
+        Qdrant stops building HNSW graphs so uploaded segments are not indexed
+        piecemeal; finish_bulk builds them once over the full load.
+        """
+        if self.use_qdrant:
+            try:
+                self.qdrant_client.update_collection(
+                    collection_name=collection_name,
+                    optimizer_config=OptimizersConfigDiff(indexing_threshold=0)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to pause Qdrant indexing: {e}")
+    
+    def finish_bulk(self, collection_name: str):
+        """End a bulk load: write the FAISS index once and re-enable Qdrant indexing"""
+        self.save_collection(collection_name)
         
-        # If Qdrant is available and we need more results, try Qdrant
-        if self.use_qdrant and len(faiss_results) < top_k:
+        if self.use_qdrant:
             try:
-                # Create filter if document IDs are specified
-                search_filter = None
-                if filter_document_ids:
-                    search_filter = Filter(
-                        must=[
-                            FieldCondition(
-                                key="document_id",
-                                match=MatchValue(value=doc_id)
-                            ) for doc_id in filter_document_ids
-                        ]
-                    )
-                
-                qdrant_results = self.qdrant_client.search(
+                self.qdrant_client.update_collection(
                     collection_name=collection_name,
-                    query_vector=query_embedding,
-                    limit=top_k - len(faiss_results),
-                    query_filter=search_filter,
-                    with_payload=True
+                    optimizer_config=OptimizersConfigDiff(indexing_threshold=QDRANT_INDEXING_THRESHOLD)
                 )
-                
-                # Convert Qdrant results to same format
-                for result in qdrant_results:
-                    qdrant_result = {
-                        'chunk_id': result.id,
-                        'score': result.score,
-                        'text': result.payload['text'],
-                        'document_id': result.payload['document_id'],
-                        'location': result.payload['location'],
-                        'headings': result.payload['headings']
-                    }
-                    
-                    # Avoid duplicates
-                    if not any(r['chunk_id'] == qdrant_result['chunk_id'] for r in faiss_results):
-                        faiss_results.append(qdrant_result)
-                
             except Exception as e:
-                logger.warning(f"Qdrant search failed: {e}")
+                logger.warning(f"Failed to resume Qdrant indexing: {e}")
+    
+    def save_collection(self, collection_name: str):
+        """Write a FAISS collection to disk"""
+        vector_index_manager.get_collection(collection_name).save()
+    
+    def search(self, collection_name: str, query_embedding: np.ndarray, 
+               top_k: int = 8, filter_document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+        """Search for similar chunks in FAISS and, when enabled, Qdrant concurrently"""
+        faiss_collection = vector_index_manager.get_collection(collection_name)
+        if not self.use_qdrant:
+            return faiss_collection.search(query_embedding, top_k, filter_document_ids)
+        
+        # Qdrant's network round trip overlaps the local FAISS search
+        qdrant_future = _SEARCH_POOL.submit(
+            self._search_qdrant, collection_name, query_embedding, top_k, filter_document_ids
+        )
+        results = faiss_collection.search(query_embedding, top_k, filter_document_ids)
         
-        return faiss_results[:top_k]
+        # Merge, skipping chunks FAISS already returned (both scores are cosine)
+        seen = {result['chunk_id'] for result in results}
+        for result in qdrant_future.result():
+            if result['chunk_id'] not in seen:
+                seen.add(result['chunk_id'])
+                results.append(result)
+        
+        results.sort(key=lambda result: result['score'], reverse=True)
+        return results[:top_k]
+    
+    def _search_qdrant(self, collection_name: str, query_embedding: np.ndarray,
+                       top_k: int, filter_document_ids: Optional[List[int]]) -> List[Dict[str, Any]]:
+        """Search the Qdrant collection, returning results in the FAISS result format"""
+        try:
+            # Create filter if document IDs are specified
+            search_filter = None
+            if filter_document_ids:
+                search_filter = Filter(
+                    must=[
+                        FieldCondition(
+                            key="document_id",
+                            match=MatchAny(any=list(filter_document_ids))
+                        )
+                    ]
+                )
+            
+            qdrant_results = self.qdrant_client.search(
+                collection_name=collection_name,
+                query_vector=query_embedding,
+                limit=top_k,
+                query_filter=search_filter,
+                with_payload=True
+            )
+            
+            # Convert Qdrant results to same format
+            return [
+                {
+                    'chunk_id': result.payload.get('chunk_id', result.id),
+                    'score': result.score,
+                    'text': result.payload['text'],
+                    'document_id': result.payload['document_id'],
+                    'location': result.payload['location'],
+                    'headings': result.payload['headings']
+                }
+                for result in qdrant_results
+            ]
+            
+        except Exception as e:
+            logger.warning(f"Qdrant search failed: {e}")
+            return []
     
     def delete_collection(self, collection_name: str):
         """Delete a collection"""
+        self._known_collections.discard(collection_name)
+        
         # Delete from FAISS
         vector_index_manager.delete_collection(collection_name)
         
@@ -1,22 +1,48 @@
+import atexit
 import logging
+import threading
 import numpy as np
 from typing import List, Dict, Any, Optional
 import faiss
 import pickle
 import os
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Chunk metadata is stored column-wise, one list per field (row i = vector i)
+METADATA_COLUMNS = ('chunk_id', 'text', 'document_id', 'location', 'headings')
+
+
+def _empty_columns() -> Dict[str, list]:
+    return {column: [] for column in METADATA_COLUMNS}
+
+
+def _check_unit_norm(vectors: np.ndarray):
+    """Spot-check that vectors are L2-normalized (inner product = cosine only then)"""
+    norms = np.linalg.norm(vectors[:4], axis=1)
+    if not np.allclose(norms, 1.0, atol=1e-3):
+        raise ValueError(f"Embeddings are not unit length (norms {norms.tolist()})")
+
 
 class FAISSIndex:
     def __init__(self, collection_name: str):
         self.collection_name = collection_name
         self.index = None
-        self.metadata = []
+        self._cols = _empty_columns()
+        self._doc_id_array = None
+        # Adds only mark the index dirty; flush() writes it out
+        self._dirty = False
+        # Loaded indexes are memory-mapped read-only until the first add
+        self._readonly = False
+        self._lock = threading.Lock()
         self.index_path = f"./indices/{collection_name}.faiss"
-        self.metadata_path = f"./indices/{collection_name}_metadata.pkl"
+        self.metadata_path = f"./indices/{collection_name}_metadata.parquet"
+        # Collections written before the Parquet store pickled a list of dicts
+        self.legacy_metadata_path = f"./indices/{collection_name}_metadata.pkl"
         self._ensure_index_dir()
         self._load_or_create_index()
     
@@ -29,52 +55,131 @@ class FAISSIndex:
         try:
             if os.path.exists(self.index_path) and os.path.exists(self.metadata_path):
                 # Load existing index
-                self.index = faiss.read_index(self.index_path)
-                with open(self.metadata_path, 'rb') as f:
-                    self.metadata = pickle.load(f)
+                self._read_index(mmap=True)
+                columns = pq.read_table(self.metadata_path).to_pydict()
+                self._cols = {column: columns.get(column, []) for column in METADATA_COLUMNS}
+                self._doc_id_array = None
                 logger.info(f"Loaded existing FAISS index: {self.collection_name}")
+            elif os.path.exists(self.index_path) and os.path.exists(self.legacy_metadata_path):
+                # Convert pickled metadata; the next save writes Parquet
+                self._read_index(mmap=True)
+                with open(self.legacy_metadata_path, 'rb') as f:
+                    rows = pickle.load(f)
+                self._cols = {column: [row.get(column) for row in rows] for column in METADATA_COLUMNS}
+                self._doc_id_array = None
+                logger.info(f"Loaded legacy FAISS index: {self.collection_name}")
             else:
-                # Create new index
-                self._create_new_index()
+                # The index is created on first add, once the embedding dimension is known
+                self.index = None
+                self._readonly = False
+                self._cols = _empty_columns()
+                self._doc_id_array = None
         except Exception as e:
             logger.warning(f"Error loading index, creating new one: {e}")
-            self._create_new_index()
+            self.index = None
+            self._readonly = False
+            self._cols = _empty_columns()
+            self._doc_id_array = None
+    
+    def _read_index(self, mmap: bool):
+        """Read the index file, memory-mapped read-only if mmap so pages load on demand"""
+        self.index = None
+        if mmap:
+            try:
+                self.index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                # Not every index type can be mapped; read it into memory instead
+                logger.info(f"Cannot mmap FAISS index {self.collection_name}: {e}")
+        self._readonly = self.index is not None
+        if self.index is None:
+            self.index = faiss.read_index(self.index_path)
+        if hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = settings.faiss_hnsw_ef_search
     
-    def _create_new_index(self):
+    def _create_new_index(self, dim: int):
         """Create a new FAISS index"""
-        # Use IndexFlatIP for cosine similarity (after normalization)
-        # Start with dimension 384 (all-MiniLM-L6-v2)
-        self.index = faiss.IndexFlatIP(384)
-        self.metadata = []
+        # Inner product gives cosine similarity (after normalization)
+        storage = settings.embedding_storage
+        
+        if settings.faiss_index == "hnsw":
+            # Graph search: O(log N) per query instead of a full scan
+            m = settings.faiss_hnsw_m
+            if storage == "int8":
+                self.index = faiss.IndexHNSWSQ(
+                    dim, faiss.ScalarQuantizer.QT_8bit, m, faiss.METRIC_INNER_PRODUCT
+                )
+            elif storage == "f16":
+                self.index = faiss.IndexHNSWSQ(
+                    dim, faiss.ScalarQuantizer.QT_fp16, m, faiss.METRIC_INNER_PRODUCT
+                )
+            else:
+                self.index = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+            self.index.hnsw.efSearch = settings.faiss_hnsw_ef_search
+        elif storage == "int8":
+            self.index = faiss.IndexScalarQuantizer(
+                dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
+        elif storage == "f16":
+            self.index = faiss.IndexScalarQuantizer(
+                dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            self.index = faiss.IndexFlatIP(dim)
+        
+        if storage == "int8":
+            # Normalized embeddings lie in [-1, 1], so train the quantizer on that range
+            bounds = np.vstack([-np.ones(dim), np.ones(dim)]).astype('float32')
+            self.index.train(bounds)
+        
+        self._readonly = False
+        self._cols = _empty_columns()
+        self._doc_id_array = None
         logger.info(f"Created new FAISS index: {self.collection_name}")
     
-    def add_chunks(self, chunks: List[Dict[str, Any]]):
-        """Add chunks to the index"""
+    def add_chunks(self, chunks: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
+        """Add chunks to the index (written to disk by the next flush).
+
+        Vectors come from each chunk's 'embedding', or from `embeddings`, an
+        (N, dim) matrix whose row i belongs to chunks[i].
+        """
         try:
             if not chunks:
                 return
             
-            # Extract embeddings
-            embeddings = np.array([chunk['embedding'] for chunk in chunks])
-            
-            # Normalize embeddings for cosine similarity
-            faiss.normalize_L2(embeddings)
-            
-            # Add to index
-            self.index.add(embeddings)
-            
-            # Store metadata
-            for chunk in chunks:
-                self.metadata.append({
-                    'chunk_id': chunk['chunk_id'],
-                    'text': chunk['text'],
-                    'document_id': chunk.get('document_id'),
-                    'location': chunk['location'],
-                    'headings': chunk.get('headings', [])
-                })
+            # Gather the float32 rows into one contiguous block (a single copy,
+            # none for a float32 matrix); EmbeddingService already returns unit
+            # vectors, so no normalize pass
+            if embeddings is None:
+                embeddings = np.vstack([chunk['embedding'] for chunk in chunks])
+            embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+            if settings.check_embedding_norms:
+                _check_unit_norm(embeddings)
             
-            # Save index and metadata
-            self._save_index()
+            with self._lock:
+                if self.index is None:
+                    self._create_new_index(embeddings.shape[1])
+                elif self._readonly:
+                    # A mapped index can't grow; copy the loaded one into memory
+                    # rather than rereading the file, which a newer flush from
+                    # another process may have replaced out from under _cols
+                    self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+                    self._readonly = False
+                    if hasattr(self.index, 'hnsw'):
+                        self.index.hnsw.efSearch = settings.faiss_hnsw_ef_search
+                
+                # Add to index
+                self.index.add(embeddings)
+                
+                # Store metadata
+                cols = self._cols
+                cols['chunk_id'].extend(chunk['chunk_id'] for chunk in chunks)
+                cols['text'].extend(chunk['text'] for chunk in chunks)
+                cols['document_id'].extend(chunk.get('document_id') for chunk in chunks)
+                cols['location'].extend(chunk['location'] for chunk in chunks)
+                cols['headings'].extend(chunk.get('headings', []) for chunk in chunks)
+                self._doc_id_array = None
+                self._dirty = True
             
             logger.info(f"Added {len(chunks)} chunks to FAISS index: {self.collection_name}")
             
@@ -82,67 +187,84 @@ class FAISSIndex:
             logger.error(f"Error adding chunks to FAISS index: {e}")
             raise
     
-    def search(self, query_embedding: List[float], top_k: int = 8, 
+    def search(self, query_embedding: np.ndarray, top_k: int = 8, 
                filter_document_ids: Optional[List[int]] = None) -> List[Dict[str, Any]]:
         """Search for similar chunks"""
         try:
-            if self.index.ntotal == 0:
-                return []
+            # View the (already normalized) query as a 1-row batch without copying
+            query_vector = np.asarray(query_embedding, dtype=np.float32).reshape(1, -1)
+            if settings.check_embedding_norms:
+                _check_unit_norm(query_vector)
+            
+            # Adds run in worker threads and may grow or swap the index; FAISS
+            # doesn't support searching an index while it's being modified
+            with self._lock:
+                if self.index is None or self.index.ntotal == 0:
+                    return []
+                
+                # Search (over-fetch so deduplication still leaves top_k documents)
+                scores, indices = self.index.search(query_vector, min(top_k * 3, self.index.ntotal))
+                
+                # Metadata columns only grow (or are replaced whole), so this
+                # snapshot stays consistent with the hits after the lock is released
+                cols = self._cols
+                all_doc_ids = self._document_id_array()
             
-            # Normalize query embedding
-            query_vector = np.array([query_embedding])
-            faiss.normalize_L2(query_vector)
+            # Drop FAISS padding (-1) and ids past the metadata
+            idxs = indices[0]
+            valid = (idxs >= 0) & (idxs < len(all_doc_ids))
+            idxs, hit_scores = idxs[valid], scores[0][valid]
+            doc_ids = all_doc_ids[idxs]
             
-            # Search
-            scores, indices = self.index.search(query_vector, min(top_k * 2, self.index.ntotal))
+            # Apply document filter if specified
+            if filter_document_ids:
+                keep = np.isin(doc_ids, np.asarray(filter_document_ids, dtype=np.int64))
+                idxs, hit_scores, doc_ids = idxs[keep], hit_scores[keep], doc_ids[keep]
             
-            results = []
-            seen_docs = set()
+            # Deduplicate by document: keep each document's best (first) hit, in rank order
+            _, first = np.unique(doc_ids, return_index=True)
+            first.sort()
             
-            for score, idx in zip(scores[0], indices[0]):
-                if idx >= len(self.metadata):
-                    continue
-                
-                metadata = self.metadata[idx]
-                
-                # Apply document filter if specified
-                if filter_document_ids and metadata['document_id'] not in filter_document_ids:
-                    continue
-                
-                # Deduplicate by document (keep only first occurrence)
-                if metadata['document_id'] in seen_docs:
-                    continue
-                
-                seen_docs.add(metadata['document_id'])
-                
-                results.append({
-                    'chunk_id': metadata['chunk_id'],
+            return [
+                {
+                    'chunk_id': cols['chunk_id'][idx],
                     'score': float(score),
-                    'text': metadata['text'],
-                    'document_id': metadata['document_id'],
-                    'location': metadata['location'],
-                    'headings': metadata['headings']
-                })
-                
-                if len(results) >= top_k:
-                    break
-            
-            return results
+                    'text': cols['text'][idx],
+                    'document_id': cols['document_id'][idx],
+                    'location': cols['location'][idx],
+                    'headings': cols['headings'][idx]
+                }
+                for idx, score in zip(idxs[first[:top_k]].tolist(), hit_scores[first[:top_k]].tolist())
+            ]
             
         except Exception as e:
             logger.error(f"Error searching FAISS index: {e}")
             return []
     
+    def _document_id_array(self) -> np.ndarray:
+        """Document ids as an int64 array (-1 for none), rebuilt after adds (caller holds the lock)"""
+        if self._doc_id_array is None:
+            self._doc_id_array = np.fromiter(
+                (-1 if doc_id is None else doc_id for doc_id in self._cols['document_id']),
+                dtype=np.int64, count=len(self._cols['document_id'])
+            )
+        return self._doc_id_array
+    
     def delete_collection(self):
         """Delete the collection"""
         try:
             if os.path.exists(self.index_path):
                 os.remove(self.index_path)
-            if os.path.exists(self.metadata_path):
-                os.remove(self.metadata_path)
+            for path in (self.metadata_path, self.legacy_metadata_path):
+                if os.path.exists(path):
+                    os.remove(path)
             
-            self.index = None
-            self.metadata = []
+            with self._lock:
+                self.index = None
+                self._readonly = False
+                self._cols = _empty_columns()
+                self._doc_id_array = None
+                self._dirty = False
             logger.info(f"Deleted FAISS collection: {self.collection_name}")
             
         except Exception as e:
@@ -150,19 +272,37 @@ class FAISSIndex:
     
     def get_collection_info(self) -> Dict[str, Any]:
         """Get collection information"""
+        with self._lock:
+            vectors_count = self.index.ntotal if self.index else 0
         return {
             'name': self.collection_name,
-            'vectors_count': self.index.ntotal if self.index else 0,
+            'vectors_count': vectors_count,
             'status': 'active',
             'type': 'faiss'
         }
     
+    def save(self):
+        """Write the index and metadata to disk now"""
+        self.flush()
+    
+    def flush(self):
+        """Write the index and metadata to disk if anything was added since the last write"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+    
     def _save_index(self):
-        """Save index and metadata to disk"""
+        """Save index and metadata to disk (caller holds the lock)"""
         try:
-            faiss.write_index(self.index, self.index_path)
-            with open(self.metadata_path, 'wb') as f:
-                pickle.dump(self.metadata, f)
+            if self.index is None:
+                return
+            # Write beside the live files and swap them in, so a reader never
+            # sees a half-written index
+            faiss.write_index(self.index, f"{self.index_path}.tmp")
+            pq.write_table(pa.Table.from_pydict(self._cols), f"{self.metadata_path}.tmp")
+            os.replace(f"{self.index_path}.tmp", self.index_path)
+            os.replace(f"{self.metadata_path}.tmp", self.metadata_path)
+            self._dirty = False
         except Exception as e:
             logger.error(f"Error saving FAISS index: {e}")
 
@@ -170,13 +310,31 @@ class FAISSIndex:
 class VectorIndexManager:
     def __init__(self):
         self.collections: Dict[str, FAISSIndex] = {}
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
     
     def get_collection(self, collection_name: str) -> FAISSIndex:
         """Get or create a collection"""
         if collection_name not in self.collections:
             self.collections[collection_name] = FAISSIndex(collection_name)
+            self._start_flusher()
         return self.collections[collection_name]
     
+    def _start_flusher(self):
+        """Start the background thread that periodically writes changed indexes"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="faiss-flush", daemon=True)
+            self._flusher.start()
+    
+    def _flush_loop(self):
+        while not self._stop.wait(settings.faiss_flush_interval):
+            self.flush_all()
+    
+    def flush_all(self):
+        """Write every changed collection to disk"""
+        for collection in list(self.collections.values()):
+            collection.flush()
+    
     def delete_collection(self, collection_name: str):
         """Delete a collection"""
         if collection_name in self.collections:
@@ -193,3 +351,6 @@ class VectorIndexManager:
 
 # Global vector index manager
 vector_index_manager = VectorIndexManager()
+
+# Don't lose the last interval's adds when the process exits
+atexit.register(vector_index_manager.flush_all)
@@ -1,13 +1,128 @@
+import csv
+import hashlib
+import io
 import os
 import tempfile
+import threading
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 import logging
+import mmap
 import fitz  # PyMuPDF
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Try to import tesserocr (optional): in-process Tesseract, no subprocess per page
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+# One loaded Tesseract engine per process, reused across pages
+_tess_api = None
+_tess_lock = threading.Lock()
+
+# Files at least this large get a kernel readahead hint before parsing
+PREFETCH_MIN_SIZE = 4 * 1024 * 1024  # 4MB
+
+# OCR text by page pixels, opened lazily in each process (diskcache is process-safe)
+_ocr_cache = None
+
+
+def _get_ocr_cache():
+    global _ocr_cache
+    if _ocr_cache is None:
+        import diskcache
+        _ocr_cache = diskcache.Cache(settings.ocr_cache_dir)
+    return _ocr_cache
+
+
+def _read_text_file(file_path: str) -> str:
+    """Decode a UTF-8 file straight from a read-only memory map.
+
+    str() decodes from the mapped pages directly, without first copying the
+    file into an intermediate bytes object.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''  # Empty files cannot be mapped
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            return str(mm, 'utf-8', 'replace')
+
+
+def _prefetch_file(file_path: str):
+    """Ask the kernel to start reading a large file into the page cache.
+
+    PyMuPDF seeks around the file (xref table at the end, then objects page by
+    page), which defeats sequential readahead; WILLNEED queues the whole file
+    for asynchronous reads so those seeks hit memory. No-op where unsupported.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            if os.fstat(fd).st_size >= PREFETCH_MIN_SIZE:
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.debug(f"Readahead hint failed for {file_path}: {e}")
+
+
+def _ocr_page(page: "fitz.Page", lang: str, dpi: int) -> Optional[str]:
+    """Render and OCR one page of an open PDF, or None if it fails.
+
+    Pages are rendered one at a time, so at most one bitmap is alive at once.
+    """
+    global _tess_api
+    try:
+        from PIL import Image
+        
+        # Grayscale at OCR resolution, handed to PIL as raw samples (no PNG encode/decode)
+        scale = dpi / 72
+        pix = page.get_pixmap(
+            matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False
+        )
+        
+        # Identical pages (re-uploads, forced re-OCR, repeated scans) reuse earlier text
+        cache_key = None
+        if settings.enable_ocr_cache:
+            cache_key = f"{hashlib.blake2b(pix.samples, digest_size=16).hexdigest()}:{lang}:{dpi}"
+            text = _get_ocr_cache().get(cache_key)
+            if text is not None:
+                return text
+        
+        # PIL copies the samples, so the pixmap is dropped before OCR runs and
+        # the image right after, rather than whenever the worker next collects
+        img = Image.frombytes("L", (pix.width, pix.height), pix.samples)
+        del pix
+        
+        try:
+            if TESSEROCR_AVAILABLE:
+                with _tess_lock:
+                    if _tess_api is None:
+                        _tess_api = tesserocr.PyTessBaseAPI(lang=lang)
+                    _tess_api.SetImage(img)
+                    text = _tess_api.GetUTF8Text()
+                    _tess_api.Clear()  # Frees Tesseract's copy of the image too
+            else:
+                import pytesseract
+                text = pytesseract.image_to_string(img, lang=lang)
+        finally:
+            img.close()
+        
+        if cache_key is not None:
+            _get_ocr_cache().set(cache_key, text)
+        return text
+    except Exception as e:
+        logger.warning(f"OCR failed: {e}")
+        return None
+
 
 class DocumentParser:
     def __init__(self):
@@ -20,6 +135,11 @@ class DocumentParser:
             logger.info("OCR disabled by configuration")
             return
             
+        if TESSEROCR_AVAILABLE:
+            self.ocr = tesserocr
+            logger.info("OCR (tesserocr) initialized successfully")
+            return
+        
         try:
             import pytesseract
             from PIL import Image
@@ -59,46 +179,46 @@ class DocumentParser:
     def _parse_pdf(self, file_path: str, force_ocr: bool = False) -> Dict[str, Any]:
         """Parse PDF with page numbers and optional OCR"""
         try:
-            doc = fitz.open(file_path)
+            page_texts = []
+            page_types = []
             
-            # Check page limit
-            if len(doc) > settings.max_pages_per_document:
-                logger.warning(f"PDF has {len(doc)} pages, limiting to {settings.max_pages_per_document}")
-                doc = fitz.open(file_path)
-                doc.select(range(settings.max_pages_per_document))
+            _prefetch_file(file_path)
+            
+            # One handle for the text and OCR passes, released even if a page fails
+            with fitz.open(file_path) as doc:
+                # Check page limit (pages past it are never loaded)
+                page_limit = min(len(doc), settings.max_pages_per_document)
+                if len(doc) > page_limit:
+                    logger.warning(f"PDF has {len(doc)} pages, limiting to {page_limit}")
+                
+                for page_num in range(page_limit):
+                    page = doc.load_page(page_num)
+                    
+                    # Extract text first
+                    text = page.get_text()
+                    page_type = 'text'
+                    
+                    # If no text and OCR is enabled, OCR the page already loaded
+                    if (not text.strip() or force_ocr) and self.ocr:
+                        ocr_text = _ocr_page(page, settings.ocr_language, settings.ocr_dpi)
+                        if ocr_text is not None:
+                            text, page_type = ocr_text, 'ocr'
+                    
+                    page_texts.append(text)
+                    page_types.append(page_type)
             
             pages = []
             total_text = ""
             
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                
-                # Extract text first
-                text = page.get_text()
-                
-                # If no text and OCR is enabled, try OCR
-                if (not text.strip() or force_ocr) and self.ocr:
-                    try:
-                        from PIL import Image
-                        pix = page.get_pixmap()
-                        img_data = pix.tobytes("png")
-                        img = Image.open(io.BytesIO(img_data))
-                        
-                        # OCR the image
-                        text = self.ocr.image_to_string(img, lang=settings.ocr_language)
-                    except Exception as ocr_error:
-                        logger.warning(f"OCR failed for page {page_num + 1}: {ocr_error}")
-                
+            for page_num, (text, page_type) in enumerate(zip(page_texts, page_types)):
                 if text.strip():
                     pages.append({
                         'page': page_num + 1,
                         'text': text,
-                        'type': 'ocr' if force_ocr and not page.get_text().strip() else 'text'
+                        'type': page_type
                     })
                     total_text += text + "\n"
             
-            doc.close()
-            
             return {
                 'text': total_text,
                 'pages': len(pages),
@@ -114,20 +234,25 @@ class DocumentParser:
             logger.error(f"Error parsing PDF: {e}")
             raise
     
-
-    
     def _parse_docx(self, file_path: str) -> Dict[str, Any]:
         """Parse DOCX document"""
         try:
             from docx import Document
             doc = Document(file_path)
             
-            paragraphs = []
-            for para in doc.paragraphs:
-                if para.text.strip():
-                    paragraphs.append(para.text)
+            # Non-empty paragraphs go straight into the join; each paragraph's
+            # text (rebuilt from its runs on every access) is read only once
+            paragraph_count = 0
+            
+            def non_empty_paragraphs():
+                nonlocal paragraph_count
+                for para in doc.paragraphs:
+                    para_text = para.text
+                    if para_text.strip():
+                        paragraph_count += 1
+                        yield para_text
             
-            text = '\n'.join(paragraphs)
+            text = '\n'.join(non_empty_paragraphs())
             
             return {
                 'text': text,
@@ -136,7 +261,7 @@ class DocumentParser:
                 'metadata': {
                     'parsing_method': 'python-docx',
                     'total_pages': 1,
-                    'paragraphs': len(paragraphs)
+                    'paragraphs': paragraph_count
                 }
             }
         except Exception as e:
@@ -146,8 +271,7 @@ class DocumentParser:
     def _parse_txt(self, file_path: str) -> Dict[str, Any]:
         """Parse text file"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+            text = _read_text_file(file_path)
             
             return {
                 'text': text,
@@ -165,21 +289,30 @@ class DocumentParser:
     def _parse_csv(self, file_path: str) -> Dict[str, Any]:
         """Parse CSV file"""
         try:
-            import pandas as pd
-            df = pd.read_csv(file_path)
+            # Stream rows straight into tab-separated text (no DataFrame)
+            buffer = io.StringIO()
+            rows = 0
+            columns = 0
+            with open(file_path, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    if rows:
+                        buffer.write('\n')
+                    else:
+                        columns = len(row)
+                    buffer.write('\t'.join(row))
+                    rows += 1
             
-            # Convert to text representation
-            text = df.to_string(index=False)
+            text = buffer.getvalue()
             
             return {
                 'text': text,
                 'pages': 1,
                 'page_content': [{'page': 1, 'text': text, 'type': 'table'}],
                 'metadata': {
-                    'parsing_method': 'pandas',
+                    'parsing_method': 'csv',
                     'total_pages': 1,
-                    'rows': len(df),
-                    'columns': len(df.columns)
+                    'rows': max(rows - 1, 0),  # Excluding the header row
+                    'columns': columns
                 }
             }
         except Exception as e:
@@ -189,34 +322,43 @@ class DocumentParser:
     def _parse_excel(self, file_path: str) -> Dict[str, Any]:
         """Parse Excel file"""
         try:
-            import pandas as pd
-            excel_file = pd.ExcelFile(file_path)
+            import openpyxl
+            # read_only streams rows from the sheet XML instead of building the
+            # whole workbook; data_only reads cached values instead of formulas
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
             
-            all_text = []
-            page_content = []
-            page_num = 1
-            
-            for sheet_name in excel_file.sheet_names:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
-                sheet_text = f"Sheet: {sheet_name}\n{df.to_string(index=False)}"
-                all_text.append(sheet_text)
+            try:
+                all_text = []
+                page_content = []
+                sheet_names = workbook.sheetnames
                 
-                page_content.append({
-                    'page': page_num,
-                    'text': sheet_text,
-                    'type': 'table',
-                    'sheet': sheet_name
-                })
-                page_num += 1
+                for page_num, worksheet in enumerate(workbook.worksheets, 1):
+                    buffer = io.StringIO()
+                    buffer.write(f"Sheet: {worksheet.title}")
+                    for row in worksheet.iter_rows(values_only=True):
+                        buffer.write('\n')
+                        buffer.write('\t'.join('' if cell is None else str(cell) for cell in row))
+                    sheet_text = buffer.getvalue()
+                    all_text.append(sheet_text)
+                    
+                    page_content.append({
+                        'page': page_num,
+                        'text': sheet_text,
+                        'type': 'table',
+                        'sheet': worksheet.title
+                    })
+            finally:
+                # Read-only workbooks keep the file open until closed
+                workbook.close()
             
             return {
                 'text': '\n\n'.join(all_text),
-                'pages': len(excel_file.sheet_names),
+                'pages': len(sheet_names),
                 'page_content': page_content,
                 'metadata': {
-                    'parsing_method': 'pandas',
-                    'total_pages': len(excel_file.sheet_names),
-                    'sheets': excel_file.sheet_names
+                    'parsing_method': 'openpyxl',
+                    'total_pages': len(sheet_names),
+                    'sheets': sheet_names
                 }
             }
         except Exception as e:
@@ -226,8 +368,7 @@ class DocumentParser:
     def _parse_generic(self, file_path: str) -> Dict[str, Any]:
         """Parse generic file as text"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                text = f.read()
+            text = _read_text_file(file_path)
             
             return {
                 'text': text,
@@ -241,3 +382,15 @@ class DocumentParser:
         except Exception as e:
             logger.error(f"Error parsing generic file: {e}")
             raise
+
+
+# Parser for the current worker process (see parse_document_file)
+_process_parser: Optional[DocumentParser] = None
+
+
+def parse_document_file(file_path: str, filetype: str) -> Dict[str, Any]:
+    """Parse a document with a per-process parser, for use from a process pool"""
+    global _process_parser
+    if _process_parser is None:
+        _process_parser = DocumentParser()
+    return _process_parser.parse_document(file_path, filetype)
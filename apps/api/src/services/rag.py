@@ -1,110 +1,176 @@
-import json
 import logging
-from typing import List, Dict, Any, Optional, Generator
+import re
+from typing import List, Dict, Any, Optional, AsyncIterable, AsyncIterator
 import httpx
+import orjson
+from cachetools import TTLCache
 from ..config import settings
 
 logger = logging.getLogger(__name__)
 
+# Messages that never need document context
+SMALL_TALK = frozenset({
+    "hi", "hello", "hey", "thanks", "thank you", "thx", "ok", "okay",
+    "bye", "goodbye", "good morning", "good evening", "cool", "great",
+})
+
+# Citation markers like [1], [2] in model output
+_CITATION_RE = re.compile(r'\[(\d+)\]')
+
+# Seconds a prompt prefix is kept after it was built
+PROMPT_CONTEXT_TTL = 600
+
+SYSTEM_PROMPT = """You are a source-grounded research assistant. Your responses must be based ONLY on the provided context. 
+
+IMPORTANT RULES:
+1. Only answer using information from the provided CONTEXT
+2. If the answer is not found in the context, say "I cannot find information about this in the provided documents."
+3. Always include inline citations like [1], [2], [3] that reference the source chunks
+4. Be concise but thorough
+5. If comparing multiple documents, create a clear comparison with citations
+6. Do not make up or infer information not present in the context"""
+
+
+def _format_chunk(index: int, chunk: Dict[str, Any]) -> str:
+    """Format one retrieved chunk as a numbered context entry"""
+    page = (chunk.get('location') or {}).get('page')
+    headings = chunk.get('headings')
+    page_part = f"Page {page}" if page else ""
+    headings_part = f" - {' > '.join(headings)}" if headings else ""
+    return f"[{index}] Source: {page_part}{headings_part}\n{chunk['text']}\n"
+
+
+async def _aiter_ndjson(chunks: AsyncIterable[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Decode newline-delimited JSON from raw byte chunks, skipping malformed lines"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                try:
+                    yield orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue
+    if buffer.strip():
+        try:
+            yield orjson.loads(buffer)
+        except orjson.JSONDecodeError:
+            pass
+
 
 class RAGService:
     def __init__(self):
         self.ollama_url = settings.ollama_url
         self.model = settings.ollama_model
+        
+        # Long-lived clients keep connections to Ollama alive across chat turns
+        limits = httpx.Limits(max_keepalive_connections=16, max_connections=32)
+        self._client = httpx.Client(base_url=self.ollama_url, timeout=30.0, limits=limits)
+        self._async_client = httpx.AsyncClient(base_url=self.ollama_url, timeout=30.0, limits=limits)
+        
+        # System prompt + context blocks keyed by the retrieved chunks' content;
+        # follow-up turns often retrieve the same chunks (only touched on the event loop)
+        self._prefix_cache = TTLCache(maxsize=settings.prompt_context_cache_size, ttl=PROMPT_CONTEXT_TTL)
     
-    def generate_response(self, query: str, retrieved_chunks: List[Dict[str, Any]], 
-                         chat_history: List[Dict[str, Any]] = None) -> Generator[str, None, None]:
+    async def close(self):
+        """Close the pooled Ollama connections"""
+        self._client.close()
+        await self._async_client.aclose()
+    
+    async def generate_response(self, query: str, retrieved_chunks: List[Dict[str, Any]], 
+                                chat_history: List[Dict[str, Any]] = None) -> AsyncIterator[str]:
         """Generate RAG response with streaming"""
         try:
             # Build the prompt
             prompt = self._build_prompt(query, retrieved_chunks, chat_history)
             
             # Call Ollama with streaming
-            for chunk in self._call_ollama_stream(prompt):
+            async for chunk in self._call_ollama_stream(prompt):
                 yield chunk
                 
         except Exception as e:
             logger.error(f"Error generating RAG response: {e}")
             yield f"Error: {str(e)}"
     
+    def should_retrieve(self, query: str) -> bool:
+        """Return False for trivial queries where a vector search would be wasted"""
+        if not settings.enable_retrieval_gating:
+            return True
+        
+        normalized = " ".join(query.lower().split()).strip(" .!?,")
+        if not any(c.isalnum() for c in normalized):
+            return False
+        
+        return normalized not in SMALL_TALK
+    
     def _build_prompt(self, query: str, retrieved_chunks: List[Dict[str, Any]], 
                      chat_history: List[Dict[str, Any]] = None) -> str:
         """Build the RAG prompt"""
-        
-        # System message
-        system_prompt = """You are a source-grounded research assistant. Your responses must be based ONLY on the provided context. 
-
-IMPORTANT RULES:
-1. Only answer using information from the provided CONTEXT
-2. If the answer is not found in the context, say "I cannot find information about this in the provided documents."
-3. Always include inline citations like [1], [2], [3] that reference the source chunks
-4. Be concise but thorough
-5. If comparing multiple documents, create a clear comparison with citations
-6. Do not make up or infer information not present in the context"""
-
-        # Build context from retrieved chunks
-        context_parts = []
-        for i, chunk in enumerate(retrieved_chunks, 1):
-            source_info = f"[{i}] Source: "
-            if chunk.get('location', {}).get('page'):
-                source_info += f"Page {chunk['location']['page']}"
-            if chunk.get('headings'):
-                source_info += f" - {' > '.join(chunk['headings'])}"
-            
-            context_parts.append(f"{source_info}\n{chunk['text']}\n")
-        
-        context = "\n".join(context_parts)
+        # Only the short conversation tail is formatted per turn
+        parts = [self._prompt_prefix(retrieved_chunks)]
         
         # Build conversation history
-        conversation = ""
         if chat_history:
             for msg in chat_history[-4:]:  # Last 4 messages
                 role = "User" if msg['role'] == 'user' else "Assistant"
-                conversation += f"{role}: {msg['content']}\n"
+                parts.extend((role, ": ", msg['content'], "\n"))
         
-        # Final prompt
-        prompt = f"""{system_prompt}
-
-CONTEXT:
-{context}
-
-{conversation}User: {query}
-
-Assistant: Based on the provided context, """
+        parts.extend(("User: ", query, "\n\nAssistant: Based on the provided context, "))
+        
+        return "".join(parts)
+    
+    def _prompt_prefix(self, retrieved_chunks: List[Dict[str, Any]]) -> str:
+        """System prompt and context block for a set of chunks, reused across turns"""
+        # Keyed on exactly what the context block is formatted from, not on
+        # chunk ids (which embed reusable document rowids); str hashes are
+        # cached, so hashing the texts is cheap
+        key = tuple(
+            (
+                (chunk.get('location') or {}).get('page'),
+                tuple(chunk.get('headings') or ()),
+                chunk['text']
+            )
+            for chunk in retrieved_chunks
+        )
+        prefix = self._prefix_cache.get(key)
+        if prefix is not None:
+            return prefix
+        
+        # Build context from retrieved chunks
+        context = "\n".join([_format_chunk(i, chunk) for i, chunk in enumerate(retrieved_chunks, 1)])
         
-        return prompt
+        prefix = "".join((SYSTEM_PROMPT, "\n\nCONTEXT:\n", context, "\n\n"))
+        self._prefix_cache[key] = prefix
+        return prefix
     
-    def _call_ollama_stream(self, prompt: str) -> Generator[str, None, None]:
-        """Call Ollama with streaming"""
+    async def _call_ollama_stream(self, prompt: str) -> AsyncIterator[str]:
+        """Call Ollama with streaming (on the event loop, no thread per stream)"""
         try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(
-                    f"{self.ollama_url}/api/generate",
-                    json={
-                        "model": self.model,
-                        "prompt": prompt,
-                        "stream": True,
-                        "options": {
-                            "temperature": 0.1,
-                            "top_p": 0.9,
-                            "max_tokens": 2000
-                        }
-                    },
-                    headers={"Content-Type": "application/json"}
-                )
-                
+            # stream() hands over tokens as they arrive instead of after the whole body
+            async with self._async_client.stream(
+                "POST",
+                "/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": True,
+                    "options": {
+                        "temperature": 0.1,
+                        "top_p": 0.9,
+                        "max_tokens": 2000
+                    }
+                },
+                headers={"Content-Type": "application/json"}
+            ) as response:
                 response.raise_for_status()
                 
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            data = json.loads(line)
-                            if 'response' in data:
-                                yield data['response']
-                            if data.get('done', False):
-                                break
-                        except json.JSONDecodeError:
-                            continue
+                # Parse raw bytes with orjson (no per-line str decode)
+                async for data in _aiter_ndjson(response.aiter_bytes(chunk_size=4096)):
+                    if 'response' in data:
+                        yield data['response']
+                    if data.get('done', False):
+                        break
                             
         except Exception as e:
             logger.error(f"Error calling Ollama: {e}")
@@ -113,25 +179,24 @@ Assistant: Based on the provided context, """
     def _call_ollama_sync(self, prompt: str) -> str:
         """Call Ollama synchronously (non-streaming)"""
         try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(
-                    f"{self.ollama_url}/api/generate",
-                    json={
-                        "model": self.model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.1,
-                            "top_p": 0.9,
-                            "max_tokens": 2000
-                        }
-                    },
-                    headers={"Content-Type": "application/json"}
-                )
-                
-                response.raise_for_status()
-                data = response.json()
-                return data.get('response', '')
+            response = self._client.post(
+                "/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": False,
+                    "options": {
+                        "temperature": 0.1,
+                        "top_p": 0.9,
+                        "max_tokens": 2000
+                    }
+                },
+                headers={"Content-Type": "application/json"}
+            )
+            
+            response.raise_for_status()
+            data = response.json()
+            return data.get('response', '')
                 
         except Exception as e:
             logger.error(f"Error calling Ollama: {e}")
@@ -141,10 +206,9 @@ Assistant: Based on the provided context, """
         """Extract citations from the response"""
         citations = []
         
-        # Find citation patterns like [1], [2], etc.
-        import re
-        citation_pattern = r'\[(\d+)\]'
-        matches = re.findall(citation_pattern, response)
+        # Find citation patterns like [1], [2], etc., each chunk cited once
+        # (dict.fromkeys dedupes while keeping first-mention order)
+        matches = dict.fromkeys(_CITATION_RE.findall(response))
         
         for match in matches:
             try:
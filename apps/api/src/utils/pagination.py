@@ -0,0 +1,33 @@
+from typing import Any, List, Optional, Tuple
+from fastapi import Response
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Clients pass this value back as ?cursor= to fetch the next page
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def keyset_page(statement, id_column, limit: int, cursor: Optional[int]):
+    """Restrict a select to one newest-first page.
+
+    Ids grow with created_at, so the id alone is a stable keyset cursor.
+    One extra row is fetched to tell whether another page exists.
+    """
+    if cursor is not None:
+        statement = statement.where(id_column < cursor)
+    return statement.order_by(id_column.desc()).limit(limit + 1)
+
+
+def split_page(rows: List[Any], limit: int) -> Tuple[List[Any], Optional[int]]:
+    """Drop the look-ahead row and return the cursor for the next page"""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1].id
+    return rows, None
+
+
+def set_next_cursor(response: Response, next_cursor: Optional[int]):
+    """Expose the next page's cursor, if any, as a response header"""
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = str(next_cursor)
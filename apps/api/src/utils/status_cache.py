@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+import orjson
+from cachetools import TTLCache
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+# In-flight document states expire if a worker dies mid-ingest
+PROGRESS_TTL = 60  # Seconds
+
+# Try to import Redis (optional)
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    logger.info("Redis not available, using in-process status cache")
+
+
+class StatusCache:
+    """Short-lived cache for the status endpoints polled during ingestion.
+
+    Entries for a bot live under one key (a Redis hash, one field per
+    endpoint), so a single delete invalidates them all.
+    """
+
+    def __init__(self):
+        self.redis_client = None
+        self._local = TTLCache(maxsize=1024, ttl=settings.status_cache_ttl)
+        self._progress = TTLCache(maxsize=1024, ttl=PROGRESS_TTL)
+        self._lock = threading.Lock()
+        self._initialize()
+
+    def _initialize(self):
+        """Use Redis when configured, otherwise fall back to an in-process cache"""
+        if REDIS_AVAILABLE and settings.redis_url:
+            try:
+                self.redis_client = redis.Redis.from_url(settings.redis_url)
+                self.redis_client.ping()
+                logger.info("Redis status cache connected")
+            except Exception as e:
+                logger.warning(f"Redis not available: {e}. Using in-process status cache.")
+                self.redis_client = None
+
+    @staticmethod
+    def _key(bot_id: int) -> str:
+        return f"botstatus:{bot_id}"
+
+    @staticmethod
+    def _progress_key(bot_id: int) -> str:
+        return f"docprogress:{bot_id}"
+
+    def get(self, bot_id: int, kind: str) -> Optional[Any]:
+        """Get a cached status payload, or None on a miss"""
+        if self.redis_client is not None:
+            try:
+                entry = self.redis_client.hget(self._key(bot_id), kind)
+                if entry is None:
+                    return None
+                # The hash's TTL is renewed by every write, so each field
+                # carries its own expiry
+                expires_at, value = orjson.loads(entry)
+                return value if time.time() < expires_at else None
+            except Exception as e:
+                logger.warning(f"Status cache read failed: {e}")
+                return None
+
+        with self._lock:
+            return self._local.get((bot_id, kind))
+
+    def set(self, bot_id: int, kind: str, value: Any):
+        """Cache a JSON-serializable status payload"""
+        if self.redis_client is not None:
+            try:
+                key = self._key(bot_id)
+                pipe = self.redis_client.pipeline()
+                pipe.hset(key, kind, orjson.dumps([time.time() + settings.status_cache_ttl, value]))
+                pipe.expire(key, settings.status_cache_ttl)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Status cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._local[(bot_id, kind)] = value
+
+    def invalidate(self, bot_id: int):
+        """Drop every cached status payload for a bot"""
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self._key(bot_id))
+            except Exception as e:
+                logger.warning(f"Status cache invalidation failed: {e}")
+            return
+
+        with self._lock:
+            for key in [key for key in self._local if key[0] == bot_id]:
+                self._local.pop(key, None)
+
+    def set_progress(self, bot_id: int, document_id: int, state: str):
+        """Record an intermediate document state without a database commit"""
+        if self.redis_client is not None:
+            try:
+                key = self._progress_key(bot_id)
+                pipe = self.redis_client.pipeline()
+                pipe.hset(key, str(document_id), state)
+                pipe.expire(key, PROGRESS_TTL)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Progress write failed: {e}")
+            return
+
+        with self._lock:
+            states = self._progress.get(bot_id, {})
+            states[document_id] = state
+            self._progress[bot_id] = states
+
+    def get_progress(self, bot_id: int) -> Dict[int, str]:
+        """Get in-flight document states for a bot, keyed by document id"""
+        if self.redis_client is not None:
+            try:
+                states = self.redis_client.hgetall(self._progress_key(bot_id))
+                return {int(k): v.decode() for k, v in states.items()}
+            except Exception as e:
+                logger.warning(f"Progress read failed: {e}")
+                return {}
+
+        with self._lock:
+            return dict(self._progress.get(bot_id, {}))
+
+    def clear_progress(self, bot_id: int, document_id: int):
+        """Forget a document's intermediate state once it's terminal"""
+        if self.redis_client is not None:
+            try:
+                self.redis_client.hdel(self._progress_key(bot_id), str(document_id))
+            except Exception as e:
+                logger.warning(f"Progress clear failed: {e}")
+            return
+
+        with self._lock:
+            states = self._progress.get(bot_id)
+            if states:
+                states.pop(document_id, None)
+
+    def publish_progress(self, task_id: str, state: str, progress: int):
+        """Announce a task's intermediate state on its Redis channel (fire-and-forget).
+
+        Subscribers listen on task:<task_id>; nothing is stored, and without
+        Redis there is nobody to notify.
+        """
+        if self.redis_client is None:
+            return
+        try:
+            self.redis_client.publish(
+                f"task:{task_id}", orjson.dumps({'state': state, 'progress': progress})
+            )
+        except Exception as e:
+            logger.warning(f"Progress publish failed: {e}")
+
+
+# Global status cache instance
+status_cache = StatusCache()
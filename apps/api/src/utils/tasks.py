@@ -1,12 +1,16 @@
 import asyncio
+import itertools
+import json
 import logging
-from typing import Dict, Any, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable
 from datetime import datetime, timedelta
 from enum import Enum
 import uuid
+from ..config import settings
 from ..models import Task
-from ..deps import get_session
-from sqlmodel import Session
+from ..deps import SESSION_BINDS, engine
+from sqlalchemy import delete, update
+from sqlmodel import Session, func, select
 
 logger = logging.getLogger(__name__)
 
@@ -22,72 +26,161 @@ class TaskStatus(str, Enum):
 class TaskManager:
     def __init__(self):
         self._tasks: Dict[str, asyncio.Task] = {}
-        self._max_concurrent = 2
-        self._semaphore = asyncio.Semaphore(2)
+        self._max_concurrent = settings.max_concurrent_tasks
+        # Pending tasks, as (priority, submission order, task_id, func)
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers: List[asyncio.Task] = []
+        self._sequence = itertools.count()
     
     async def submit_task(
         self,
         task_type: str,
         task_data: Dict[str, Any],
         task_func: Callable,
-        session: Session
+        session: Session,
+        parent_id: Optional[str] = None,
+        priority: int = 0
     ) -> str:
-        """Submit a task for execution"""
+        """Submit a task for execution (lower priority values start first, ties in order).
+
+        `session` only records the task; the task itself runs with short
+        sessions of its own, after the request's session is gone.
+        """
         task_id = str(uuid.uuid4())
         
         # Create task record
         task = Task(
             id=task_id,
+            parent_id=parent_id,
             type=task_type,
-            data=task_data,
-            status=TaskStatus.PENDING,
-            created_at=datetime.utcnow()
+            data=json.dumps(task_data),
+            status=TaskStatus.PENDING
         )
         session.add(task)
         session.commit()
         
-        # Submit for execution
-        asyncio.create_task(self._execute_task(task_id, task_func, session))
+        # Queue for execution
+        self._ensure_workers()
+        self._queue.put_nowait((priority, next(self._sequence), task_id, task_func))
         
         return task_id
     
-    async def _execute_task(
-        self,
-        task_id: str,
-        task_func: Callable,
-        session: Session
-    ):
-        """Execute a task with resource limits"""
-        async with self._semaphore:
+    def _ensure_workers(self):
+        """Start the worker coroutines on first use (inside the running loop)"""
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._workers = [
+                asyncio.create_task(self._worker()) for _ in range(self._max_concurrent)
+            ]
+    
+    async def _worker(self):
+        """Run queued tasks one at a time, lowest priority value first"""
+        while True:
+            _, _, task_id, task_func = await self._queue.get()
             try:
-                # Update status to running
-                task = session.get(Task, task_id)
-                if task:
-                    task.status = TaskStatus.RUNNING
-                    task.started_at = datetime.utcnow()
-                    session.commit()
-                
-                # Execute the task
-                result = await task_func()
-                
-                # Update status to completed
-                task = session.get(Task, task_id)
-                if task:
-                    task.status = TaskStatus.COMPLETED
-                    task.completed_at = datetime.utcnow()
-                    task.result = result
-                    session.commit()
-                
+                await self._execute_task(task_id, task_func)
             except Exception as e:
-                logger.error(f"Task {task_id} failed: {e}")
-                
-                # Update status to failed
-                task = session.get(Task, task_id)
-                if task:
-                    task.status = TaskStatus.FAILED
-                    task.completed_at = datetime.utcnow()
-                    task.error = str(e)
-                    session.commit()
+                # Keep the worker alive for the tasks queued behind this one
+                logger.error(f"Task {task_id} could not be recorded: {e}")
+            finally:
+                self._queue.task_done()
+    
+    async def _execute_task(self, task_id: str, task_func: Callable):
+        """Execute a task (concurrency is bounded by the number of workers)"""
+        try:
+            # Update status to running, unless it was cancelled while queued
+            if not await asyncio.to_thread(self._mark_running, task_id):
+                return
+            
+            # Execute the task
+            result = await task_func()
+            
+            # Update status to completed
+            await asyncio.to_thread(
+                self._mark_finished, task_id, TaskStatus.COMPLETED,
+                result=json.dumps(result, default=str)
+            )
+            
+        except Exception as e:
+            logger.error(f"Task {task_id} failed: {e}")
+            
+            # Update status to failed
+            await asyncio.to_thread(self._mark_finished, task_id, TaskStatus.FAILED, error=str(e))
+    
+    def _mark_running(self, task_id: str) -> bool:
+        """Mark a queued task RUNNING with one UPDATE; False if it was cancelled or removed"""
+        with Session(engine, binds=SESSION_BINDS) as session:
+            result = session.execute(
+                update(Task)
+                .where(Task.id == task_id, Task.status != TaskStatus.CANCELLED)
+                .values(status=TaskStatus.RUNNING, started_at=datetime.utcnow())
+            )
+            session.commit()
+            return result.rowcount > 0
+    
+    def _mark_finished(self, task_id: str, status: TaskStatus, **fields):
+        """Record a task's terminal status (and result or error) in its own transaction"""
+        with Session(engine, binds=SESSION_BINDS) as session:
+            parent_id = self._lock_parent(task_id, session)
+            session.execute(
+                update(Task)
+                .where(Task.id == task_id)
+                .values(status=status, completed_at=datetime.utcnow(), **fields)
+            )
+            if parent_id:
+                self._finish_batch(parent_id, session)
+            session.commit()
+    
+    def _lock_parent(self, task_id: str, session: Session) -> Optional[str]:
+        """Return a task's batch id, locking the batch row so sibling tasks
+        finishing at the same time count each other's final states"""
+        parent_id = session.exec(select(Task.parent_id).where(Task.id == task_id)).first()
+        if parent_id:
+            session.exec(select(Task.id).where(Task.id == parent_id).with_for_update()).first()
+        return parent_id
+    
+    def _finish_batch(self, batch_id: str, session: Session):
+        """Give a batch its terminal status once none of its tasks is pending or running"""
+        counts = self.get_batch_counts(batch_id, session)
+        if counts.get(TaskStatus.PENDING, 0) or counts.get(TaskStatus.RUNNING, 0):
+            return
+        
+        failed = counts.get(TaskStatus.FAILED, 0) + counts.get(TaskStatus.CANCELLED, 0)
+        session.execute(
+            update(Task)
+            .where(Task.id == batch_id)
+            .values(
+                status=TaskStatus.FAILED if failed else TaskStatus.COMPLETED,
+                completed_at=datetime.utcnow()
+            )
+        )
+    
+    def create_batch(self, task_type: str, task_data: Dict[str, Any], session: Session) -> str:
+        """Create a parent record that groups the tasks of one request.
+
+        The batch is RUNNING until its last task finishes, then COMPLETED (or
+        FAILED if any task failed or was cancelled), so cleanup_old_tasks
+        eventually removes it too.
+        """
+        batch_id = str(uuid.uuid4())
+        session.add(Task(
+            id=batch_id,
+            type=task_type,
+            data=json.dumps(task_data),
+            status=TaskStatus.RUNNING,
+            started_at=datetime.utcnow()
+        ))
+        session.commit()
+        return batch_id
+    
+    def get_batch_counts(self, batch_id: str, session: Session) -> Dict[str, int]:
+        """Count a batch's child tasks by status in a single query"""
+        rows = session.exec(
+            select(Task.status, func.count())
+            .where(Task.parent_id == batch_id)
+            .group_by(Task.status)
+        ).all()
+        return {status: count for status, count in rows}
     
     def get_task_status(self, task_id: str, session: Session) -> Optional[Dict[str, Any]]:
         """Get task status"""
@@ -98,6 +191,7 @@ class TaskManager:
         return {
             "id": task.id,
             "type": task.type,
+            "parent_id": task.parent_id,
             "status": task.status,
             "created_at": task.created_at,
             "started_at": task.started_at,
@@ -114,6 +208,9 @@ class TaskManager:
         
         task.status = TaskStatus.CANCELLED
         task.completed_at = datetime.utcnow()
+        if task.parent_id:
+            session.flush()
+            self._finish_batch(task.parent_id, session)
         session.commit()
         
         # Cancel the asyncio task if it's running
@@ -127,16 +224,18 @@ class TaskManager:
         """Clean up old completed/failed tasks"""
         cutoff_date = datetime.utcnow() - timedelta(days=days)
         
-        old_tasks = session.query(Task).filter(
-            Task.status.in_([TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]),
-            Task.completed_at < cutoff_date
-        ).all()
-        
-        for task in old_tasks:
-            session.delete(task)
+        # One DELETE statement, without loading the rows as ORM objects
+        result = session.execute(
+            delete(Task)
+            .where(
+                Task.status.in_([TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED]),
+                Task.completed_at < cutoff_date
+            )
+            .execution_options(synchronize_session=False)
+        )
         
         session.commit()
-        logger.info(f"Cleaned up {len(old_tasks)} old tasks")
+        logger.info(f"Cleaned up {result.rowcount} old tasks")
 
 
 # Global task manager instance
@@ -1,114 +1,414 @@
+import asyncio
+import hashlib
+import json
 import os
 import logging
-from typing import Dict, Any, List
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from typing import Deque, Dict, Any, Iterator, List, Optional, Tuple
+import numpy as np
+import orjson
+from cachetools import LRUCache
 from celery import current_task
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlalchemy import update
 from sqlmodel import Session, select
 from ..deps import engine
-from ..models import Document, Chunk, Bot
-from ..services.parsing import DocumentParser
-from ..services.chunking import SemanticChunker
+from ..models import Document, Chunk, Bot, UrlSource
+from ..services.parsing import parse_document_file
+from ..services.chunking import semantic_chunker
 from ..services.embed import EmbeddingService
 from ..services.index import VectorIndex
 from ..services.crawl import WebCrawler
+from ..config import settings
+from ..utils.status_cache import status_cache
 from .celery_app import celery_app
 
 logger = logging.getLogger(__name__)
 
+# Chunk rows sent per bulk INSERT (bounds the parameter list built at once)
+CHUNK_INSERT_BATCH_SIZE = 1000
+
+# Documents with at least this many chunks are loaded with COPY on Postgres
+CHUNK_COPY_MIN_ROWS = 2000
+
+# Crawled pages waiting to be chunked (the crawler pauses when the queue is full)
+CRAWL_QUEUE_SIZE = 64
+
+# Threads embedding batches side by side (started lazily, after the worker forks)
+_EMBED_POOL = ThreadPoolExecutor(
+    max_workers=max(settings.embedding_concurrency, 1), thread_name_prefix="embedding"
+)
+
+# Writes parsed text to disk while the task goes on to chunk and embed it
+_WRITE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parsed-write")
+
+# Chunk vectors keyed by a hash of the chunk text (shared by the embedding threads)
+_chunk_vector_cache = LRUCache(maxsize=settings.chunk_embedding_cache_size)
+_chunk_vector_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _get_embedder() -> EmbeddingService:
+    """The worker process's embedding service (model loaded once, shared by its tasks)"""
+    return EmbeddingService()
+
+
+@lru_cache(maxsize=1)
+def _get_vector_index() -> VectorIndex:
+    """The worker process's vector index (Qdrant client connected once)"""
+    return VectorIndex()
+
+
+@worker_process_init.connect
+def _warm_worker(**kwargs):
+    """Load the embedding model when a worker process starts, not in its first task
+    (after the fork, so each process owns exactly one copy)"""
+    _get_embedder()
+
+
+# One event loop per worker process, running in a background thread, and a
+# crawler bound to it: pooled connections and DNS answers outlive each task
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_crawler: Optional[WebCrawler] = None
+
+
+def _run_async(coro):
+    """Run a coroutine on the worker's persistent event loop and wait for its result"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="worker-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
+
+
+async def _get_crawler() -> WebCrawler:
+    """Get the worker's crawler, created on the worker loop so its asyncio primitives bind there"""
+    global _crawler
+    if _crawler is None:
+        _crawler = WebCrawler()
+    return _crawler
+
+
+@worker_process_shutdown.connect
+def _close_worker_loop(**kwargs):
+    """Release the crawler's connections and stop the loop when the worker process exits"""
+    if _loop is None:
+        return
+    if _crawler is not None:
+        try:
+            _run_async(_crawler.close())
+        except Exception as e:
+            logger.warning(f"Failed to close crawler: {e}")
+    _loop.call_soon_threadsafe(_loop.stop)
+
+
+def _emit_progress(task, state: str, progress: int):
+    """Publish an intermediate task state (kept out of the Celery result backend)"""
+    status_cache.publish_progress(task.request.id, state, progress)
+
+
+def _set_status(model, pk: int, status: str):
+    """Set a row's status with one UPDATE on a bare connection (no ORM session)"""
+    with engine.begin() as conn:
+        conn.execute(update(model).where(model.id == pk).values(status=status))
+
+
+def _write_text(path: str, text: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def _insert_chunks(session: Session, bot_id: int, document_id: int, chunks_data: List[Dict[str, Any]]):
+    """Bulk insert chunk records as plain mappings (skips per-object unit-of-work overhead)"""
+    if len(chunks_data) >= CHUNK_COPY_MIN_ROWS and _copy_chunks(session, bot_id, document_id, chunks_data):
+        return
+    
+    # Serializing location/headings dominates building each row; orjson does
+    # it in native code (the JSON stays readable by json.loads)
+    dumps = orjson.dumps
+    for start in range(0, len(chunks_data), CHUNK_INSERT_BATCH_SIZE):
+        session.bulk_insert_mappings(Chunk, [
+            {
+                'bot_id': bot_id,
+                'document_id': document_id,
+                'chunk_id': chunk_data['chunk_id'],
+                'text': chunk_data['text'],
+                'location': dumps(chunk_data['location']).decode(),
+                'headings': dumps(chunk_data['headings']).decode()
+            }
+            for chunk_data in chunks_data[start:start + CHUNK_INSERT_BATCH_SIZE]
+        ])
+
+
+def _copy_chunks(session: Session, bot_id: int, document_id: int, chunks_data: List[Dict[str, Any]]) -> bool:
+    """Stream chunk records with Postgres COPY, in the session's transaction.
+
+    Returns False, having written nothing, unless the database is Postgres on
+    psycopg 3 (whose cursors have copy()).
+    """
+    connection = session.connection()
+    if connection.dialect.name != "postgresql":
+        return False
+    cursor = connection.connection.cursor()
+    try:
+        if not hasattr(cursor, "copy"):
+            return False
+        
+        dumps = orjson.dumps
+        # COPY skips SQLAlchemy's column defaults, and older tables have no
+        # server default for created_at
+        created_at = datetime.utcnow()
+        with cursor.copy(
+            f"COPY {Chunk.__tablename__} "
+            "(bot_id, document_id, chunk_id, text, location, headings, created_at) FROM STDIN"
+        ) as copy:
+            for chunk_data in chunks_data:
+                copy.write_row((
+                    bot_id,
+                    document_id,
+                    chunk_data['chunk_id'],
+                    chunk_data['text'],
+                    dumps(chunk_data['location']).decode(),
+                    dumps(chunk_data['headings']).decode(),
+                    created_at
+                ))
+        return True
+    finally:
+        cursor.close()
+
+
+def _embed_batch(embedder: EmbeddingService, batch: List[Dict[str, Any]]) -> np.ndarray:
+    """Embed a batch of chunks, encoding each distinct text not seen before once.
+
+    Vectors are reused by a hash of the chunk text: crawled sites repeat the
+    same navigation and footer text on every page, and re-ingested documents
+    repeat whole chunks.
+    """
+    keys = [hashlib.blake2b(chunk['text'].encode(), digest_size=16).digest() for chunk in batch]
+    with _chunk_vector_cache_lock:
+        vectors = [_chunk_vector_cache.get(key) for key in keys]
+    
+    # Texts to encode, once each, in first-seen order
+    missing: Dict[bytes, str] = {}
+    for key, chunk, vector in zip(keys, batch, vectors):
+        if vector is None and key not in missing:
+            missing[key] = chunk['text']
+    if not missing:
+        return np.vstack(vectors)
+    
+    fresh = embedder.embed_texts_array(list(missing.values()))
+    fresh_by_key = dict(zip(missing, fresh))
+    with _chunk_vector_cache_lock:
+        # Copies, so a cached row does not keep its whole batch array alive
+        _chunk_vector_cache.update((key, vector.copy()) for key, vector in fresh_by_key.items())
+    
+    if len(missing) == len(batch):
+        return fresh  # Nothing reused, rows already in batch order
+    return np.vstack([
+        vector if vector is not None else fresh_by_key[key]
+        for key, vector in zip(keys, vectors)
+    ])
+
+
+def _iter_embed_concurrently(
+    embedder: EmbeddingService,
+    chunks_data: List[Dict[str, Any]]
+) -> Iterator[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+    """Yield (vectors, batch) pairs in order, embedding batches over the embedding pool.
+
+    At most embedding_concurrency batches are in flight ahead of the consumer,
+    so peak memory follows the batch size rather than the document size.
+    """
+    batch_size = settings.embedding_batch_size
+    batches = (chunks_data[start:start + batch_size] for start in range(0, len(chunks_data), batch_size))
+    if settings.embedding_concurrency <= 1 or len(chunks_data) <= batch_size:
+        for batch in batches:
+            yield _embed_batch(embedder, batch), batch
+        return
+    
+    # encode() releases the GIL inside its kernels (and remote embedders wait
+    # on I/O), so batches overlap while earlier ones are being indexed
+    in_flight: Deque[Tuple[Future, List[Dict[str, Any]]]] = deque()
+    for batch in batches:
+        in_flight.append((_EMBED_POOL.submit(_embed_batch, embedder, batch), batch))
+        if len(in_flight) > settings.embedding_concurrency:
+            future, done = in_flight.popleft()
+            yield future.result(), done
+    
+    while in_flight:
+        future, done = in_flight.popleft()
+        yield future.result(), done
+
+
+async def _crawl_and_index(
+    crawler: WebCrawler,
+    embedder: EmbeddingService,
+    vector_index: VectorIndex,
+    collection_name: str,
+    root_url: str,
+    depth: int,
+    document_id: int,
+    parsed_path: str
+) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Crawl pages while already-fetched pages are written, chunked, embedded and indexed.
+
+    The crawler feeds pages into a bounded queue; a single consumer appends
+    each page to the parsed text file, chunks it, and embeds and indexes chunks
+    in full batches in worker threads, so fetches overlap the CPU work and no
+    page text is kept once it has been chunked. Returns the crawled URLs and
+    the chunks, in crawl order.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=CRAWL_QUEUE_SIZE)
+    urls: List[str] = []
+    
+    async def produce():
+        try:
+            async for page in crawler.iter_pages(root_url, depth):
+                await queue.put(page)  # Waits while the consumer is behind
+        except asyncio.CancelledError:
+            raise  # Only cancelled once the consumer has stopped
+        except Exception:
+            await queue.put(None)  # Let the consumer finish; awaiting us re-raises
+            raise
+        await queue.put(None)  # End of crawl
+    
+    chunks: List[Dict[str, Any]] = []
+    
+    async def index(batch: List[Dict[str, Any]]):
+        await asyncio.to_thread(
+            vector_index.add_batches, collection_name, _iter_embed_concurrently(embedder, batch)
+        )
+        chunks.extend(batch)
+    
+    async def consume(parsed_file):
+        pending: List[Dict[str, Any]] = []
+        while True:
+            page = await queue.get()
+            if page is None:
+                break
+            urls.append(page['url'])
+            
+            # Each crawled page is its own "page", keeping chunk ids unique
+            page_text = crawler.format_page(page)
+            parsed_file.write(page_text)
+            pending.extend(await asyncio.to_thread(semantic_chunker.chunk_text, page_text, {
+                'document_id': document_id,
+                'source_type': 'crawled',
+                'page_content': [{'page': len(urls), 'text': page_text, 'type': 'text'}]
+            }))
+            
+            if len(pending) >= settings.embedding_batch_size:
+                await index(pending)
+                pending = []
+        
+        if pending:
+            await index(pending)
+    
+    producer = asyncio.create_task(produce())
+    try:
+        # Same text as process_crawled_content, written as pages arrive
+        with open(parsed_path, 'w', encoding='utf-8') as parsed_file:
+            await consume(parsed_file)
+        await producer  # Surfaces crawl errors
+        return urls, chunks
+    finally:
+        producer.cancel()
+
 
 @celery_app.task(bind=True)
 def process_document(self, document_id: int, bot_id: int):
-    """Process a document through the full pipeline"""
+    """Process a document through the full pipeline (written once, on the terminal state)"""
     try:
+        # Short sessions only: no transaction is held while parsing or embedding,
+        # so the API's writers never wait on the shared database
         with Session(engine) as session:
-            # Get document
             document = session.get(Document, document_id)
             if not document:
                 raise ValueError(f"Document {document_id} not found")
-            
-            # Update status to PARSING
-            document.status = "PARSING"
-            session.commit()
-            
-            # Parse document
-            self.update_state(state='PARSING', meta={'progress': 20})
-            parser = DocumentParser()
-            parsed_data = parser.parse_document(document.path_original, document.filetype)
-            
-            # Save parsed content
-            parsed_path = f"{document.path_original}.parsed.txt"
-            with open(parsed_path, 'w', encoding='utf-8') as f:
-                f.write(parsed_data['text'])
-            
-            document.path_parsed = parsed_path
-            document.pages = parsed_data.get('pages', 1)
-            document.metadata.update(parsed_data.get('metadata', {}))
-            document.status = "CHUNKING"
-            session.commit()
-            
-            # Chunk document
-            self.update_state(state='CHUNKING', meta={'progress': 40})
-            chunker = SemanticChunker()
-            chunks_data = chunker.chunk_text(parsed_data['text'], {
-                'document_id': document_id,
-                'page_content': parsed_data.get('page_content', [])
-            })
-            
-            # Create chunk records
-            chunks = []
-            for chunk_data in chunks_data:
-                chunk = Chunk(
-                    bot_id=bot_id,
-                    document_id=document_id,
-                    chunk_id=chunk_data['chunk_id'],
-                    text=chunk_data['text'],
-                    location=chunk_data['location'],
-                    headings=chunk_data['headings']
-                )
-                chunks.append(chunk)
-            
-            session.add_all(chunks)
-            document.status = "EMBEDDING"
-            session.commit()
-            
-            # Embed chunks
-            self.update_state(state='EMBEDDING', meta={'progress': 60})
-            embedder = EmbeddingService()
-            embedded_chunks = embedder.embed_chunks(chunks_data)
-            
-            # Index chunks
-            self.update_state(state='INDEXING', meta={'progress': 80})
-            vector_index = VectorIndex()
+            path_original, filetype = document.path_original, document.filetype
+        
+        # Intermediate states are published and kept in the status cache
+        # (Redis, shared with the API); the database and the result backend
+        # only see DONE or ERROR
+        _emit_progress(self, 'PARSING', 20)
+        status_cache.set_progress(bot_id, document_id, "PARSING")
+        
+        # Parse document (with this process's long-lived parser)
+        parsed_data = parse_document_file(path_original, filetype)
+        
+        # Save parsed content in the background; chunking works from memory
+        parsed_path = f"{path_original}.parsed.txt"
+        parsed_write = _WRITE_POOL.submit(_write_text, parsed_path, parsed_data['text'])
+        
+        # Chunk document
+        _emit_progress(self, 'CHUNKING', 40)
+        status_cache.set_progress(bot_id, document_id, "CHUNKING")
+        chunks_data = semantic_chunker.chunk_text(parsed_data['text'], {
+            'document_id': document_id,
+            'page_content': parsed_data.get('page_content', [])
+        })
+        
+        # A document without text has nothing to embed or index
+        collection_name = f"bot_{bot_id}"
+        if chunks_data:
+            # Embed and index chunks
+            _emit_progress(self, 'EMBEDDING', 60)
+            status_cache.set_progress(bot_id, document_id, "EMBEDDING")
+            embedder = _get_embedder()
+            vector_index = _get_vector_index()
             
             # Create collection if it doesn't exist
-            collection_name = f"bot_{bot_id}"
             embedding_dim = embedder.get_embedding_dimension()
             vector_index.create_collection(collection_name, embedding_dim)
             
-            # Add chunks to vector database
-            vector_index.add_chunks(collection_name, embedded_chunks)
+            # Each batch goes into the vector database as soon as it is embedded
+            # (no document-wide vector matrix); indexes are built once at the end
+            vector_index.begin_bulk(collection_name)
+            try:
+                vector_index.add_batches(collection_name, _iter_embed_concurrently(embedder, chunks_data))
+            finally:
+                vector_index.finish_bulk(collection_name)
+        
+        # The parsed file must exist before the document is marked DONE
+        parsed_write.result()
+        
+        # Chunk records and the DONE status go in one short transaction
+        with Session(engine) as session:
+            document = session.get(Document, document_id)
+            if not document:
+                raise ValueError(f"Document {document_id} not found")
             
-            # Update document status
+            document.path_parsed = parsed_path
+            document.pages = parsed_data.get('pages', 1)
+            document.merge_metadata(parsed_data.get('metadata', {}))
+            _insert_chunks(session, bot_id, document_id, chunks_data)
             document.status = "DONE"
             session.commit()
-            
-            self.update_state(state='DONE', meta={'progress': 100})
-            
-            return {
-                'status': 'success',
-                'document_id': document_id,
-                'chunks_created': len(chunks),
-                'collection': collection_name
-            }
+        status_cache.clear_progress(bot_id, document_id)
+        status_cache.invalidate(bot_id)
+        
+        self.update_state(state='DONE', meta={'progress': 100})
+        
+        return {
+            'status': 'success',
+            'document_id': document_id,
+            'chunks_created': len(chunks_data),
+            'collection': collection_name
+        }
             
     except Exception as e:
         logger.error(f"Error processing document {document_id}: {e}")
         
-        # Update document status to ERROR
-        with Session(engine) as session:
-            document = session.get(Document, document_id)
-            if document:
-                document.status = "ERROR"
-                session.commit()
+        # Update document status to ERROR (the final transaction rolled back)
+        _set_status(Document, document_id, "ERROR")
+        status_cache.clear_progress(bot_id, document_id)
+        status_cache.invalidate(bot_id)
         
         self.update_state(state='ERROR', meta={'error': str(e)})
         raise
@@ -116,30 +416,20 @@ def process_document(self, document_id: int, bot_id: int):
 
 @celery_app.task(bind=True)
 def process_url(self, url_source_id: int, bot_id: int):
-    """Process a URL through crawling and indexing"""
+    """Process a URL through crawling and indexing (written once, on the terminal state)"""
+    document_id = None
     try:
-        with Session(engine) as session:
+        # Short sessions only: no transaction is held during the crawl
+        with Session(engine, expire_on_commit=False) as session:
             # Get URL source
-            from ..models import UrlSource
             url_source = session.get(UrlSource, url_source_id)
             if not url_source:
                 raise ValueError(f"URL source {url_source_id} not found")
+            root_url, depth = url_source.root_url, url_source.depth
             
-            # Update status to CRAWLING
-            url_source.status = "CRAWLING"
-            session.commit()
-            
-            # Crawl URL
-            self.update_state(state='CRAWLING', meta={'progress': 30})
-            crawler = WebCrawler()
-            
-            import asyncio
-            crawled_data = asyncio.run(crawler.crawl_url(url_source.root_url, url_source.depth))
-            
-            # Process crawled content
-            content_text = crawler.process_crawled_content(crawled_data)
-            
-            # Create a virtual document for the crawled content
+            # Create a virtual document for the crawled content; its id is
+            # needed up front because pages are chunked as they arrive, and it
+            # is committed so the id can't be handed out again
             document = Document(
                 bot_id=bot_id,
                 filename=f"crawled_{url_source_id}.txt",
@@ -147,89 +437,76 @@ def process_url(self, url_source_id: int, bot_id: int):
                 path_original=f"crawled_{url_source_id}.txt",
                 path_parsed=f"crawled_{url_source_id}.txt",
                 pages=1,
-                status="CHUNKING",
-                metadata={
-                    'source_type': 'crawled',
-                    'root_url': url_source.root_url,
-                    'crawled_urls': len(crawled_data['crawled_urls']),
-                    'depth': url_source.depth
-                }
+                status="PENDING"
             )
-            
             session.add(document)
             session.commit()
-            
-            # Save crawled content
-            with open(document.path_parsed, 'w', encoding='utf-8') as f:
-                f.write(content_text)
-            
-            # Chunk content
-            self.update_state(state='CHUNKING', meta={'progress': 50})
-            chunker = SemanticChunker()
-            chunks_data = chunker.chunk_text(content_text, {
-                'document_id': document.id,
-                'source_type': 'crawled'
-            })
-            
-            # Create chunk records
-            chunks = []
-            for chunk_data in chunks_data:
-                chunk = Chunk(
-                    bot_id=bot_id,
-                    document_id=document.id,
-                    chunk_id=chunk_data['chunk_id'],
-                    text=chunk_data['text'],
-                    location=chunk_data['location'],
-                    headings=chunk_data['headings']
-                )
-                chunks.append(chunk)
-            
-            session.add_all(chunks)
-            document.status = "EMBEDDING"
-            session.commit()
-            
-            # Embed chunks
-            self.update_state(state='EMBEDDING', meta={'progress': 70})
-            embedder = EmbeddingService()
-            embedded_chunks = embedder.embed_chunks(chunks_data)
-            
-            # Index chunks
-            self.update_state(state='INDEXING', meta={'progress': 90})
-            vector_index = VectorIndex()
-            
-            # Create collection if it doesn't exist
-            collection_name = f"bot_{bot_id}"
-            embedding_dim = embedder.get_embedding_dimension()
-            vector_index.create_collection(collection_name, embedding_dim)
-            
-            # Add chunks to vector database
-            vector_index.add_chunks(collection_name, embedded_chunks)
+            document_id, parsed_path = document.id, document.path_parsed
+        
+        # Create collection if it doesn't exist
+        embedder = _get_embedder()
+        vector_index = _get_vector_index()
+        collection_name = f"bot_{bot_id}"
+        embedding_dim = embedder.get_embedding_dimension()
+        vector_index.create_collection(collection_name, embedding_dim)
+        
+        # Crawl, chunk, embed and index as one pipeline (intermediate states
+        # are only published); indexes are built once at the end
+        _emit_progress(self, 'CRAWLING', 30)
+        crawler = _run_async(_get_crawler())
+        vector_index.begin_bulk(collection_name)
+        try:
+            crawled_urls, chunks_data = _run_async(_crawl_and_index(
+                crawler, embedder, vector_index, collection_name,
+                root_url, depth, document_id, parsed_path
+            ))
+        finally:
+            vector_index.finish_bulk(collection_name)
+        
+        # Chunk records and both statuses go in one short transaction
+        _emit_progress(self, 'INDEXING', 90)
+        with Session(engine) as session:
+            document = session.get(Document, document_id)
+            url_source = session.get(UrlSource, url_source_id)
+            if not document or not url_source:
+                raise ValueError(f"URL source {url_source_id} or its document was deleted")
+            
+            document.pages = max(len(crawled_urls), 1)
+            document.doc_metadata = json.dumps({
+                'source_type': 'crawled',
+                'root_url': root_url,
+                'crawled_urls': len(crawled_urls),
+                'depth': depth
+            }, separators=(',', ':'))
+            _insert_chunks(session, bot_id, document_id, chunks_data)
             
             # Update statuses
             document.status = "DONE"
             url_source.status = "DONE"
-            url_source.fetched_urls = [url['url'] for url in crawled_data['crawled_urls']]
+            url_source.fetched_urls = json.dumps(crawled_urls)
             session.commit()
-            
-            self.update_state(state='DONE', meta={'progress': 100})
-            
-            return {
-                'status': 'success',
-                'url_source_id': url_source_id,
-                'document_id': document.id,
-                'chunks_created': len(chunks),
-                'urls_crawled': len(crawled_data['crawled_urls'])
-            }
+        status_cache.invalidate(bot_id)
+        
+        self.update_state(state='DONE', meta={'progress': 100})
+        
+        return {
+            'status': 'success',
+            'url_source_id': url_source_id,
+            'document_id': document_id,
+            'chunks_created': len(chunks_data),
+            'urls_crawled': len(crawled_urls)
+        }
             
     except Exception as e:
         logger.error(f"Error processing URL {url_source_id}: {e}")
         
-        # Update URL source status to ERROR
-        with Session(engine) as session:
-            url_source = session.get(UrlSource, url_source_id)
-            if url_source:
-                url_source.status = "ERROR"
-                session.commit()
+        # Update URL source status to ERROR, along with its document once that
+        # was committed (any vectors already indexed stay tied to its id, which
+        # is never reused while the row exists)
+        _set_status(UrlSource, url_source_id, "ERROR")
+        if document_id is not None:
+            _set_status(Document, document_id, "ERROR")
+        status_cache.invalidate(bot_id)
         
         self.update_state(state='ERROR', meta={'error': str(e)})
         raise